@@ -1 +1,10 @@
-__all__ = ['api_gateway', 'ssm']
+__all__ = [
+    'api_gateway',
+    'batch',
+    'dynamodb',
+    'event_bridge',
+    'idempotency',
+    'rate_limiting',
+    'routing',
+    'ssm',
+]
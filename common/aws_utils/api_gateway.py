@@ -1,9 +1,21 @@
+import base64
+import concurrent.futures
 import functools
+import hashlib
+import hmac
 import http
+import io
+import itertools
 import json
+import os
 import typing
+import urllib.parse
+import uuid
+
+import boto3
 
 from common import exceptions
+from common.aws_utils import dynamodb, ssm
 from common.logging import setup_logger
 
 
@@ -13,6 +25,20 @@ NO_CONTENT = type(
     'NO_CONTENT', (), {'__doc__': 'Singleton value representing an empty HTTP response body'}
 )()
 
+# Lambda rejects serialized response payloads over 6 MB, in which the body is a JSON string
+# whose escaping can nearly double its size; the threshold applies to the whole payload
+DEFAULT_OFFLOAD_THRESHOLD_BYTES = 5 * 1024 * 1024
+DEFAULT_OFFLOAD_PART_SIZE_BYTES = 8 * 1024 * 1024
+DEFAULT_OFFLOAD_URL_EXPIRES_IN_SECONDS = 60 * 60
+
+DEFAULT_PAGE_LIMIT = 50
+DEFAULT_MAX_PAGE_LIMIT = 1000
+CURSOR_SIGNATURE_BYTES = 16
+
+
+class SerializedJSON(str):
+    """A string of already-serialized JSON, used as an :class:`HTTPResponse` body as-is"""
+
 
 # fmt: off
 def get_querystring_parameter(
@@ -75,13 +101,19 @@ class HTTPResponse(dict):
             status_code: HTTP response status code
             body: JSON-serializable value to use as the HTTP response body.
                 If the :attr:`NO_CONTENT` singleton is provided, the response body will be empty.
-                Defaults to :attr:`No_CONTENT`.
+                If a :class:`SerializedJSON` string is provided, it is used without
+                being serialized again. Defaults to :attr:`No_CONTENT`.
             extra_headers: Dictionary of extra HTTP headers to be included in the response
                 or ``None`` if no extra headers should be added. Defaults to ``None``.
         """
         super().__init__()
 
-        serialized_body = '' if body is NO_CONTENT else json.dumps(body)
+        if body is NO_CONTENT:
+            serialized_body = ''
+        elif isinstance(body, SerializedJSON):
+            serialized_body = str(body)
+        else:
+            serialized_body = json.dumps(body)
 
         headers = {
             'Access-Control-Allow-Origin': '*',
@@ -105,6 +137,9 @@ def format_errors(fn: typing.Callable) -> typing.Callable:
             Results in a response with a ``400`` status code
         - :class:`~exceptions.HTTPNotFoundError`:
             Results in a response with a ``404`` status code
+        - Any other :class:`~exceptions.HTTPError`:
+            Results in a response with the exception's ``status_code``,
+            including any extra ``headers`` it defines (e.g. ``Retry-After``)
     """
 
     @functools.wraps(fn)
@@ -117,7 +152,9 @@ def format_errors(fn: typing.Callable) -> typing.Callable:
                 f'due to {type(e)} exception: {str(e)}'
             )
             return HTTPResponse(
-                status_code=e.status_code, body={'description': e.description, 'error': str(e)}
+                status_code=e.status_code,
+                body={'description': e.description, 'error': str(e)},
+                extra_headers=e.headers,
             )
 
     return wrapper
@@ -135,3 +172,318 @@ def requires_json_payload(fn: typing.Callable) -> typing.Callable:
         return fn(event, context)
 
     return wrapper
+
+
+def _upload_to_s3(
+    bucket_name: str, key: str, data: bytes, content_type: str, part_size: int
+) -> None:
+    """Uploads ``data`` to S3, concurrently in ``part_size`` parts if it exceeds a single part"""
+    s3 = boto3.client('s3')
+    if len(data) <= part_size:
+        s3.put_object(Bucket=bucket_name, Key=key, Body=data, ContentType=content_type)
+        return
+
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket_name, Key=key, ContentType=content_type
+    )['UploadId']
+    view = memoryview(data)
+
+    def upload_part(part_number):
+        offset = (part_number - 1) * part_size
+        response = s3.upload_part(
+            Bucket=bucket_name,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=view[offset : offset + part_size].tobytes(),
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    part_count = -(-len(data) // part_size)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(part_count, 4)) as pool:
+            parts = list(pool.map(upload_part, range(1, part_count + 1)))
+        s3.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+        raise
+
+
+def offloads_large_responses(
+    bucket_name: typing.Optional[str] = None,
+    threshold_bytes: int = DEFAULT_OFFLOAD_THRESHOLD_BYTES,
+    expires_in: int = DEFAULT_OFFLOAD_URL_EXPIRES_IN_SECONDS,
+    redirect: bool = False,
+    key_prefix: str = 'responses/',
+    part_size: int = DEFAULT_OFFLOAD_PART_SIZE_BYTES,
+) -> typing.Callable:
+    """Decorator factory for API Gateway handler functions that moves response bodies to S3
+    when the serialized response is larger than ``threshold_bytes``, so that they are not
+    subject to the Lambda payload limit.
+
+    The threshold is compared against the whole response as Lambda serializes it (including
+    headers and the escaping of the JSON string body), not just the body. Bodies of responses
+    over the threshold are uploaded to S3 (with a multipart upload if they exceed
+    ``part_size``) and replaced by either:
+        - a small JSON envelope, with the original status code, of the form
+          ``{"url": ..., "expires_in": ..., "content_length": ..., "content_type": ...}``
+        - or, if ``redirect`` is ``True``, an empty ``303 See Other`` response whose
+          ``Location`` header is the presigned URL
+
+    Responses at or under the threshold are returned unchanged.
+
+    .. note::
+
+        Offloaded objects are never deleted by this decorator; the bucket should have
+        a lifecycle rule that expires objects under ``key_prefix``.
+
+    Examples:
+        .. code-block:: python
+
+            @api_gateway.offloads_large_responses(redirect=True)
+            @api_gateway.format_errors
+            def export__http(event, context):
+                ...
+
+    Args:
+        bucket_name: The S3 bucket to which large bodies are uploaded.
+            Defaults to the value of the ``RESPONSE_OFFLOAD_BUCKET_NAME`` environment variable.
+        threshold_bytes: The serialized response size above which a body is offloaded
+        expires_in: Number of seconds for which the presigned URL is valid
+        redirect: If ``True``, responds with a redirect to the presigned URL
+            instead of a JSON envelope. Defaults to ``False``.
+        key_prefix: The prefix of the S3 keys under which bodies are stored
+        part_size: The size of each part of a multipart upload; must be at least 5 MB
+    """
+
+    def decorator(fn: typing.Callable) -> typing.Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            response = fn(*args, **kwargs)
+            if len(json.dumps(response).encode('utf-8')) <= threshold_bytes:
+                return response
+
+            encoded_body = response['body'].encode('utf-8')
+            headers = dict(response['headers'])
+            content_type = headers.pop('Content-Type', 'application/json')
+            bucket = bucket_name or os.environ['RESPONSE_OFFLOAD_BUCKET_NAME']
+            key = f'{key_prefix}{uuid.uuid4()}'
+            _upload_to_s3(bucket, key, encoded_body, content_type, part_size)
+
+            url = boto3.client('s3').generate_presigned_url(
+                'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires_in
+            )
+            logger.info(
+                f'Offloaded {len(encoded_body)} byte response body to s3://{bucket}/{key}'
+            )
+
+            if redirect:
+                headers['Location'] = url
+                return HTTPResponse(
+                    status_code=http.HTTPStatus.SEE_OTHER, extra_headers=headers
+                )
+            return HTTPResponse(
+                status_code=int(response['statusCode']),
+                body={
+                    'url': url,
+                    'expires_in': expires_in,
+                    'content_length': len(encoded_body),
+                    'content_type': content_type,
+                },
+                extra_headers=headers,
+            )
+
+        return wrapper
+
+    return decorator
+
+
+def _get_cursor_secret_key(secret_key: typing.Optional[str]) -> bytes:
+    if secret_key is None:
+        ssm_key = os.environ.get('PAGINATION_CURSOR_SECRET_KEY__SSM_KEY')
+        if ssm_key:
+            secret_key = ssm.get_ssm_parameter_value(ssm_key)
+        else:
+            secret_key = os.environ['PAGINATION_CURSOR_SECRET_KEY']
+    return secret_key.encode('utf-8')
+
+
+def encode_cursor(
+    state: typing.Any,
+    secret_key: typing.Optional[str] = None,
+    path: typing.Optional[str] = None,
+) -> str:
+    """Encodes a JSON-serializable pagination state as a compact, signed, URL-safe cursor
+
+    Args:
+        state: The pagination state, e.g. the key of the last item on a page
+        secret_key: The key used to sign the cursor. Defaults to the value of the SSM
+            parameter named by the ``PAGINATION_CURSOR_SECRET_KEY__SSM_KEY`` environment
+            variable or, if that is not set, of the ``PAGINATION_CURSOR_SECRET_KEY``
+            environment variable.
+        path: (Optional) The request path to which the cursor is bound;
+            :func:`decode_cursor` rejects the cursor for any other path
+
+    Returns:
+        str: An opaque cursor
+    """
+    payload = json.dumps(
+        {'p': path, 's': state}, separators=(',', ':'), default=dynamodb.json_default
+    ).encode('utf-8')
+    signature = hmac.new(_get_cursor_secret_key(secret_key), payload, hashlib.sha256).digest()
+    token = base64.urlsafe_b64encode(signature[:CURSOR_SIGNATURE_BYTES] + payload)
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_cursor(
+    cursor: str, secret_key: typing.Optional[str] = None, path: typing.Optional[str] = None
+) -> typing.Any:
+    """Decodes a cursor produced by :func:`encode_cursor`
+
+    Args:
+        cursor: The opaque cursor
+        secret_key: The key used to sign the cursor. Defaults to the value of the SSM
+            parameter named by the ``PAGINATION_CURSOR_SECRET_KEY__SSM_KEY`` environment
+            variable or, if that is not set, of the ``PAGINATION_CURSOR_SECRET_KEY``
+            environment variable.
+        path: (Optional) The request path to which the cursor must be bound
+
+    Returns:
+        The pagination state
+
+    Raises:
+        exceptions.QuerystringParameterError: If the cursor is malformed, its signature
+            is invalid, or it was issued for another path
+    """
+    try:
+        token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    except (ValueError, TypeError) as e:
+        raise exceptions.QuerystringParameterError('Invalid cursor') from e
+
+    signature, payload = token[:CURSOR_SIGNATURE_BYTES], token[CURSOR_SIGNATURE_BYTES:]
+    expected_signature = hmac.new(
+        _get_cursor_secret_key(secret_key), payload, hashlib.sha256
+    ).digest()[:CURSOR_SIGNATURE_BYTES]
+    if not payload or not hmac.compare_digest(signature, expected_signature):
+        raise exceptions.QuerystringParameterError('Invalid cursor')
+
+    decoded = json.loads(payload.decode('utf-8'))
+    if not isinstance(decoded, dict) or 's' not in decoded or decoded.get('p') != path:
+        raise exceptions.QuerystringParameterError('Cursor was issued for another path')
+    return decoded['s']
+
+
+def _get_limit(event: dict, default_limit: int, max_limit: int) -> int:
+    limit = get_querystring_parameter(event, 'limit', default=default_limit)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= max_limit:
+        raise exceptions.QuerystringParameterError(
+            f'limit must be an integer between 1 and {max_limit}'
+        )
+    return limit
+
+
+def paginate(
+    event: dict,
+    get_items: typing.Callable[[typing.Any], typing.Iterable],
+    get_cursor: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None,
+    default_limit: int = DEFAULT_PAGE_LIMIT,
+    max_limit: int = DEFAULT_MAX_PAGE_LIMIT,
+    secret_key: typing.Optional[str] = None,
+) -> HTTPResponse:
+    """Builds a response containing one page of items, read from the ``limit`` and ``cursor``
+    querystring parameters.
+
+    Items are pulled from ``get_items`` only until the page is full (plus one more item,
+    to find out whether another page exists) and each item is serialized as soon as it is
+    pulled, so the page is written in a single pass without holding the items in a list.
+    The response body has the form ``{"items": [...], "cursor": ..., "next": ...}``, where
+    ``cursor`` is an opaque signed cursor for the next page and ``next`` is the URL path
+    of the next page (both ``null`` on the last page). The ``next`` path is also provided
+    in a ``Link`` header. Cursors are bound to the event's ``path``, so a cursor issued
+    for one paginated path (e.g. ``/v1/things/1/parts``) is rejected by every other
+    (e.g. ``/v1/things/2/parts``).
+
+    Examples:
+        .. code-block:: python
+
+            def get_things(after):
+                kwargs = {'ExclusiveStartKey': after} if after else {}
+                return dynamodb.query('things', KeyConditionExpression=..., **kwargs)
+
+            return api_gateway.paginate(
+                event, get_things, get_cursor=lambda item: {'pk': item['pk'], 'sk': item['sk']}
+            )
+
+    Args:
+        event: The API Gateway invocation event that provides incoming request data
+        get_items: A function returning an iterable (ideally a generator) of items.
+            It is called with ``None`` for the first page and otherwise with the value that
+            ``get_cursor`` returned for the last item of the previous page.
+        get_cursor: (Optional) A function returning the JSON-serializable state from which
+            ``get_items`` resumes after the given item. If omitted, pages are resumed by offset:
+            ``get_items`` is always called with ``None`` and previously returned items
+            are skipped.
+        default_limit: The page size used when no ``limit`` parameter is provided
+        max_limit: The largest allowed ``limit`` parameter
+        secret_key: The key used to sign cursors. Defaults to the value of the SSM parameter
+            named by the ``PAGINATION_CURSOR_SECRET_KEY__SSM_KEY`` environment variable or,
+            if that is not set, of the ``PAGINATION_CURSOR_SECRET_KEY`` environment variable.
+
+    Returns:
+        HTTPResponse: The page of items
+
+    Raises:
+        exceptions.QuerystringParameterError: If the ``limit`` or ``cursor`` parameters
+            are invalid
+    """
+    limit = _get_limit(event, default_limit, max_limit)
+    cursor = get_querystring_parameter(event, 'cursor')
+    path = event.get('path')
+    state = None if cursor is None else decode_cursor(cursor, secret_key, path)
+
+    if get_cursor is None:
+        offset = state or 0
+        items = itertools.islice(get_items(None), offset, None)
+    else:
+        items = iter(get_items(state))
+
+    encoder = json.JSONEncoder(default=dynamodb.json_default)
+    body = io.StringIO()
+    body.write('{"items":[')
+    last_item = None
+    count = 0
+    for item in items:
+        if count == limit:
+            break
+        if count:
+            body.write(',')
+        for chunk in encoder.iterencode(item):
+            body.write(chunk)
+        last_item = item
+        count += 1
+    else:
+        # The source was exhausted before the page overflowed; there is no next page
+        last_item = None
+
+    headers = {}
+    next_cursor = next_path = None
+    if last_item is not None:
+        next_state = offset + count if get_cursor is None else get_cursor(last_item)
+        next_cursor = encode_cursor(next_state, secret_key, path)
+        query = dict(event.get('queryStringParameters') or {}, cursor=next_cursor, limit=limit)
+        next_path = f'{path or ""}?{urllib.parse.urlencode(query)}'
+        headers['Link'] = f'<{next_path}>; rel="next"'
+
+    body.write('],"cursor":')
+    body.write(json.dumps(next_cursor))
+    body.write(',"next":')
+    body.write(json.dumps(next_path))
+    body.write('}')
+
+    return HTTPResponse(body=SerializedJSON(body.getvalue()), extra_headers=headers)
@@ -0,0 +1,163 @@
+import base64
+import collections
+import concurrent.futures
+import functools
+import time
+import typing
+
+from common.logging import setup_logger
+
+
+logger = setup_logger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+
+BatchMetrics = collections.namedtuple(
+    'BatchMetrics',
+    (
+        'records',
+        'failed_records',
+        'duration_ms',
+        'records_per_second',
+        'p50_latency_ms',
+        'p99_latency_ms',
+        'max_latency_ms',
+    ),
+)
+BatchMetrics.__doc__ = 'Metrics describing the processing of a single batch of records'
+
+
+def get_record_id(record: dict) -> str:
+    """Returns the identifier used to report a failed SQS or Kinesis record in
+    ``batchItemFailures``: the SQS ``messageId`` or the Kinesis ``sequenceNumber``
+    """
+    if 'kinesis' in record:
+        return record['kinesis']['sequenceNumber']
+    return record['messageId']
+
+
+def get_ordering_key(record: dict) -> typing.Optional[str]:
+    """Returns the key whose records must be processed in order, or ``None`` if the record
+    may be processed independently of all others.
+
+    - SQS FIFO records are ordered by their ``MessageGroupId``
+    - Kinesis records are ordered by shard and partition key, which preserves the order
+      in which records with the same partition key were written to their shard
+    - Standard SQS records are unordered
+    """
+    if 'kinesis' in record:
+        shard_id = record.get('eventID', '').partition(':')[0]
+        return f'{record.get("eventSourceARN")}/{shard_id}/{record["kinesis"]["partitionKey"]}'
+    return (record.get('attributes') or {}).get('MessageGroupId')
+
+
+def get_record_data(record: dict) -> str:
+    """Returns the payload of an SQS record (its ``body``)
+    or of a Kinesis record (its base64-decoded ``data``)
+    """
+    if 'kinesis' in record:
+        return base64.b64decode(record['kinesis']['data']).decode('utf-8')
+    return record['body']
+
+
+def _percentile(sorted_values: typing.Sequence[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def processes_batch(
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    ordering_key: typing.Callable[[dict], typing.Optional[str]] = get_ordering_key,
+) -> typing.Callable:
+    """Decorator factory that turns a function processing a single SQS or Kinesis record into
+    a Lambda handler function for a whole batch of records.
+
+    Records are processed concurrently on a thread pool of at most ``max_workers`` threads.
+    Records that share an ordering key (see :func:`get_ordering_key`) are processed
+    sequentially in the order received; once one of them fails, the rest of that group
+    is skipped so that it can be retried in order.
+
+    Any exception raised while processing a record is logged and the record is reported
+    in the handler's ``batchItemFailures`` response. The event source mapping must be configured
+    with ``functionResponseType: ReportBatchItemFailures``. For SQS, only the failed (and skipped)
+    records are retried. For Kinesis, Lambda checkpoints at the lowest reported sequence number
+    and re-delivers every later record in the shard, including records in other ordering groups
+    that were already processed successfully, so Kinesis record functions must be idempotent.
+
+    Examples:
+        .. code-block:: python
+
+            @batch.processes_batch(max_workers=4)
+            def load_order__sqs(record, context):
+                order = json.loads(batch.get_record_data(record))
+                ...
+
+    Args:
+        max_workers: The maximum number of records processed concurrently
+        ordering_key: A function returning the ordering key of a record, or ``None``
+            if the record may be processed independently of all others
+    """
+
+    def decorator(fn: typing.Callable) -> typing.Callable:
+        @functools.wraps(fn)
+        def wrapper(event: dict, context: object) -> dict:
+            started_at = time.monotonic()
+            records = event.get('Records') or []
+
+            groups = collections.OrderedDict()
+            for index, record in enumerate(records):
+                key = ordering_key(record)
+                groups.setdefault(index if key is None else key, []).append(record)
+
+            def process_group(group_records):
+                latencies, failures = [], []
+                for position, record in enumerate(group_records):
+                    record_started_at = time.monotonic()
+                    try:
+                        fn(record, context)
+                    except Exception:
+                        logger.exception(f'Failed to process record {get_record_id(record)}')
+                        failures.extend(group_records[position:])
+                        break
+                    finally:
+                        latencies.append((time.monotonic() - record_started_at) * 1000)
+                return latencies, failures
+
+            latencies, failures = [], []
+            worker_count = max(1, min(max_workers, len(groups)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as pool:
+                for group_latencies, group_failures in pool.map(process_group, groups.values()):
+                    latencies.extend(group_latencies)
+                    failures.extend(group_failures)
+
+            duration_seconds = time.monotonic() - started_at
+            latencies.sort()
+            metrics = BatchMetrics(
+                records=len(records),
+                failed_records=len(failures),
+                duration_ms=round(duration_seconds * 1000, 3),
+                records_per_second=(
+                    round(len(records) / duration_seconds, 3) if duration_seconds else 0.0
+                ),
+                p50_latency_ms=round(_percentile(latencies, 50), 3),
+                p99_latency_ms=round(_percentile(latencies, 99), 3),
+                max_latency_ms=round(latencies[-1], 3) if latencies else 0.0,
+            )
+            logger.info(
+                f'Processed {len(records) - len(failures)} of {len(records)} record(s)',
+                extra={'batch': metrics._asdict()},
+            )
+            wrapper.last_metrics = metrics
+
+            return {
+                'batchItemFailures': [
+                    {'itemIdentifier': get_record_id(record)} for record in failures
+                ]
+            }
+
+        wrapper.last_metrics = None
+        return wrapper
+
+    return decorator
@@ -0,0 +1,452 @@
+import collections
+import concurrent.futures
+import decimal
+import json
+import random
+import threading
+import time
+import typing
+
+import boto3
+
+from common import exceptions
+from common.logging import setup_logger
+
+
+logger = setup_logger(__name__)
+
+BATCH_GET_ITEM_LIMIT = 100
+BATCH_WRITE_ITEM_LIMIT = 25
+DEFAULT_MAX_RETRIES = 8
+DEFAULT_BACKOFF_BASE_SECONDS = 0.05
+DEFAULT_BACKOFF_MAX_SECONDS = 5.0
+DEFAULT_CACHE_SIZE = 1024
+
+
+def json_default(value: typing.Any) -> typing.Any:
+    """``default`` function for :func:`json.dumps` that serializes the Decimals with which
+    boto3 represents DynamoDB numbers as ints (if integral) or floats
+
+    Raises:
+        TypeError: If the value is not a Decimal
+    """
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _cache_key_default(value: typing.Any) -> typing.Any:
+    # Decimal key values must hash the same as the ints/floats that callers typically provide;
+    # cache keys only need to be stable, so any other value (e.g. Binary) is hashed as a string
+    try:
+        return json_default(value)
+    except TypeError:
+        return str(value)
+
+
+class ItemCache:
+    """A thread-safe, bounded, least-recently-used read-through cache of DynamoDB items,
+    keyed by table name and primary key.
+
+    When ``ttl`` is ``None``, cached items never expire on their own; such a cache is intended
+    to be created (or :meth:`clear`-ed) once per Lambda invocation. When ``ttl`` is provided,
+    cached items expire ``ttl`` seconds after they were stored, which allows the cache to be
+    shared safely across invocations of a warm Lambda container.
+
+    Items that could not be found are cached as well, so repeated lookups of a missing key
+    do not result in repeated calls to the DynamoDB API.
+    """
+
+    MISSING = type('MISSING', (), {'__doc__': 'Cached marker for an item that does not exist'})()
+
+    def __init__(self, ttl: typing.Optional[float] = None, max_size: int = DEFAULT_CACHE_SIZE):
+        """Initializes a new ItemCache
+
+        Args:
+            ttl: Number of seconds for which each cached item remains valid,
+                or ``None`` if cached items should never expire. Defaults to ``None``.
+            max_size: The maximum number of cached items; the least recently used
+                are evicted first
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(table_name: str, key: dict) -> typing.Tuple[str, str]:
+        return table_name, json.dumps(key, sort_keys=True, default=_cache_key_default)
+
+    def get(self, table_name: str, key: dict) -> typing.Any:
+        """Returns the cached item for the given table and key, :attr:`MISSING` if the item
+        is cached as non-existent, or ``None`` if no (unexpired) cache entry exists
+        """
+        cache_key = self.make_key(table_name, key)
+        with self._lock:
+            try:
+                expires_at, item = self._items[cache_key]
+            except KeyError:
+                return None
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._items[cache_key]
+                return None
+            self._items.move_to_end(cache_key)
+        return item
+
+    def set(self, table_name: str, key: dict, item: typing.Optional[dict]):
+        """Caches ``item`` for the given table and key. ``None`` is cached as :attr:`MISSING`."""
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        cache_key = self.make_key(table_name, key)
+        with self._lock:
+            self._items[cache_key] = (expires_at, self.MISSING if item is None else item)
+            self._items.move_to_end(cache_key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, table_name: str, key: dict):
+        with self._lock:
+            self._items.pop(self.make_key(table_name, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+def _chunks(values: typing.Iterable, size: int) -> typing.Iterator[list]:
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _sleep_with_backoff(attempt: int, base: float, maximum: float):
+    """Sleeps for an exponentially-increasing, fully-jittered amount of time"""
+    time.sleep(random.uniform(0, min(maximum, base * (2 ** attempt))))
+
+
+def _item_key(item: dict, key_attributes: typing.Sequence[str]) -> dict:
+    return {attribute: item[attribute] for attribute in key_attributes}
+
+
+def get_item(
+    table_name: str,
+    key: dict,
+    cache: typing.Optional[ItemCache] = None,
+    consistent_read: bool = False,
+) -> typing.Optional[dict]:
+    """Retrieves a single item from a DynamoDB table, optionally through an :class:`ItemCache`
+
+    Args:
+        table_name: The name of the DynamoDB table
+        key: The primary key of the desired item, e.g. ``{'pk': 'foo', 'sk': 'bar'}``
+        cache: (Optional) A read-through cache to consult before calling the DynamoDB API.
+            Retrieved items (including missing items) are stored in this cache.
+        consistent_read: If ``True``, a strongly-consistent read is performed.
+            Defaults to ``False``.
+
+    Returns:
+        dict: The item, or ``None`` if no item exists for the given key
+    """
+    if cache is not None:
+        cached = cache.get(table_name, key)
+        if cached is not None:
+            return None if cached is ItemCache.MISSING else cached
+
+    table = boto3.resource('dynamodb').Table(table_name)
+    item = table.get_item(Key=key, ConsistentRead=consistent_read).get('Item')
+
+    if cache is not None:
+        cache.set(table_name, key, item)
+
+    return item
+
+
+def batch_get_items(
+    table_name: str,
+    keys: typing.Iterable[dict],
+    cache: typing.Optional[ItemCache] = None,
+    consistent_read: bool = False,
+    projection_expression: typing.Optional[str] = None,
+    expression_attribute_names: typing.Optional[dict] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+) -> typing.List[dict]:
+    """Retrieves many items from a DynamoDB table using as few ``BatchGetItem`` calls as possible.
+
+    Keys are sent in chunks of :const:`BATCH_GET_ITEM_LIMIT`. Any ``UnprocessedKeys``
+    returned by DynamoDB (e.g. due to throttling) are retried with exponential backoff.
+
+    Examples:
+        .. code-block:: python
+
+            >>> batch_get_items('my-table', [{'pk': 'a'}, {'pk': 'b'}, {'pk': 'does-not-exist'}])
+            [{'pk': 'a', 'value': 1}, {'pk': 'b', 'value': 2}]
+
+    Args:
+        table_name: The name of the DynamoDB table
+        keys: The primary keys of the desired items. Duplicate keys are only retrieved once.
+        cache: (Optional) A read-through cache to consult before calling the DynamoDB API.
+            Cannot be combined with ``projection_expression``, since partial items
+            must not be cached.
+        consistent_read: If ``True``, strongly-consistent reads are performed.
+            Defaults to ``False``.
+        projection_expression: (Optional) The attributes to retrieve for each item
+        expression_attribute_names: (Optional) Substitution tokens for attribute names
+            used in ``projection_expression``
+        max_retries: Maximum number of times to retry unprocessed keys for each chunk
+
+    Returns:
+        list: The retrieved items, in no particular order. Keys for which no item
+            exists are omitted.
+
+    Raises:
+        ValueError: If both ``cache`` and ``projection_expression`` are provided
+        exceptions.UnprocessedItemsError: If some keys remain unprocessed after
+            ``max_retries`` retries
+    """
+    if cache is not None and projection_expression is not None:
+        raise ValueError('Projected (partial) items cannot be stored in an item cache')
+
+    items = []
+    unique_keys = {}
+    for key in keys:
+        cache_key = ItemCache.make_key(table_name, key)
+        if cache_key in unique_keys:
+            continue
+        if cache is not None:
+            cached = cache.get(table_name, key)
+            if cached is not None:
+                unique_keys[cache_key] = None
+                if cached is not ItemCache.MISSING:
+                    items.append(cached)
+                continue
+        unique_keys[cache_key] = key
+
+    keys_to_fetch = [key for key in unique_keys.values() if key is not None]
+    if not keys_to_fetch:
+        return items
+
+    dynamodb = boto3.resource('dynamodb')
+    key_attributes = list(keys_to_fetch[0].keys())
+    request_options = {'ConsistentRead': consistent_read}
+    if projection_expression is not None:
+        request_options['ProjectionExpression'] = projection_expression
+    if expression_attribute_names is not None:
+        request_options['ExpressionAttributeNames'] = expression_attribute_names
+
+    fetched_items = []
+    for chunk in _chunks(keys_to_fetch, BATCH_GET_ITEM_LIMIT):
+        request_items = {table_name: dict(request_options, Keys=chunk)}
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            fetched_items.extend(response['Responses'].get(table_name, []))
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                if attempt >= max_retries:
+                    raise exceptions.UnprocessedItemsError(
+                        f'{len(request_items[table_name]["Keys"])} key(s) remained unprocessed '
+                        f'after {max_retries} retries',
+                        unprocessed=request_items,
+                    )
+                logger.debug(
+                    f'Retrying {len(request_items[table_name]["Keys"])} unprocessed key(s) '
+                    f'from table {table_name} (attempt {attempt + 1})'
+                )
+                _sleep_with_backoff(
+                    attempt, DEFAULT_BACKOFF_BASE_SECONDS, DEFAULT_BACKOFF_MAX_SECONDS
+                )
+                attempt += 1
+
+    if cache is not None:
+        found_keys = set()
+        for item in fetched_items:
+            key = _item_key(item, key_attributes)
+            found_keys.add(ItemCache.make_key(table_name, key))
+            cache.set(table_name, key, item)
+        for key in keys_to_fetch:
+            if ItemCache.make_key(table_name, key) not in found_keys:
+                cache.set(table_name, key, None)
+
+    items.extend(fetched_items)
+    return items
+
+
+def batch_write_items(
+    table_name: str,
+    put_items: typing.Iterable[dict] = (),
+    delete_keys: typing.Iterable[dict] = (),
+    cache: typing.Optional[ItemCache] = None,
+    key_attributes: typing.Optional[typing.Sequence[str]] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+) -> int:
+    """Puts and/or deletes many items in a DynamoDB table using as few ``BatchWriteItem`` calls
+    as possible.
+
+    Write requests are sent in chunks of :const:`BATCH_WRITE_ITEM_LIMIT`. Any ``UnprocessedItems``
+    returned by DynamoDB (e.g. due to throttling) are retried with exponential backoff.
+
+    .. note::
+
+        ``BatchWriteItem`` rejects a batch that contains more than one request for the same key.
+        Callers are responsible for de-duplicating their input.
+
+    Args:
+        table_name: The name of the DynamoDB table
+        put_items: Items to be created or replaced
+        delete_keys: Primary keys of items to be deleted
+        cache: (Optional) An item cache from which written and deleted items are invalidated.
+            Requires ``key_attributes`` to be provided when ``put_items`` is non-empty.
+        key_attributes: (Optional) Names of the table's primary key attributes,
+            used to derive cache keys from ``put_items``
+        max_retries: Maximum number of times to retry unprocessed items for each chunk
+
+    Returns:
+        int: The number of write requests that were processed
+
+    Raises:
+        exceptions.UnprocessedItemsError: If some write requests remain unprocessed after
+            ``max_retries`` retries
+    """
+    put_items = list(put_items)
+    delete_keys = list(delete_keys)
+    if cache is not None and put_items and not key_attributes:
+        raise ValueError('key_attributes are required to invalidate cached items')
+
+    write_requests = [{'PutRequest': {'Item': item}} for item in put_items] + [
+        {'DeleteRequest': {'Key': key}} for key in delete_keys
+    ]
+    if not write_requests:
+        return 0
+
+    dynamodb = boto3.resource('dynamodb')
+    for chunk in _chunks(write_requests, BATCH_WRITE_ITEM_LIMIT):
+        request_items = {table_name: chunk}
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_write_item(RequestItems=request_items)
+            request_items = response.get('UnprocessedItems') or {}
+            if request_items:
+                if attempt >= max_retries:
+                    raise exceptions.UnprocessedItemsError(
+                        f'{len(request_items[table_name])} write request(s) remained '
+                        f'unprocessed after {max_retries} retries',
+                        unprocessed=request_items,
+                    )
+                logger.debug(
+                    f'Retrying {len(request_items[table_name])} unprocessed write request(s) '
+                    f'to table {table_name} (attempt {attempt + 1})'
+                )
+                _sleep_with_backoff(
+                    attempt, DEFAULT_BACKOFF_BASE_SECONDS, DEFAULT_BACKOFF_MAX_SECONDS
+                )
+                attempt += 1
+
+    if cache is not None:
+        for item in put_items:
+            cache.invalidate(table_name, _item_key(item, key_attributes))
+        for key in delete_keys:
+            cache.invalidate(table_name, key)
+
+    return len(write_requests)
+
+
+def _paginate(operation: typing.Callable, **kwargs) -> typing.Iterator[dict]:
+    while True:
+        response = operation(**kwargs)
+        yield from response.get('Items', [])
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+def query(table_name: str, **kwargs) -> typing.Iterator[dict]:
+    """Lazily yields every item matched by a DynamoDB ``Query``, following ``LastEvaluatedKey``
+    so that further pages are only requested as the caller consumes items.
+
+    Examples:
+        .. code-block:: python
+
+            >>> from boto3.dynamodb.conditions import Key
+            >>> for item in query('my-table', KeyConditionExpression=Key('pk').eq('foo')):
+            ...     print(item)
+
+    Args:
+        table_name: The name of the DynamoDB table
+        **kwargs: Keyword arguments passed through to :meth:`DynamoDB.Table.query`
+
+    Returns:
+        Iterator[dict]: A generator of matched items
+    """
+    return _paginate(boto3.resource('dynamodb').Table(table_name).query, **kwargs)
+
+
+def scan(table_name: str, **kwargs) -> typing.Iterator[dict]:
+    """Lazily yields every item read by a DynamoDB ``Scan``, following ``LastEvaluatedKey``
+    so that further pages are only requested as the caller consumes items.
+
+    Args:
+        table_name: The name of the DynamoDB table
+        **kwargs: Keyword arguments passed through to :meth:`DynamoDB.Table.scan`
+
+    Returns:
+        Iterator[dict]: A generator of scanned items
+    """
+    return _paginate(boto3.resource('dynamodb').Table(table_name).scan, **kwargs)
+
+
+def parallel_scan(
+    table_name: str, total_segments: int, max_workers: typing.Optional[int] = None, **kwargs
+) -> typing.Iterator[dict]:
+    """Yields every item in a DynamoDB table by scanning ``total_segments`` segments concurrently
+    on a thread pool.
+
+    Items are yielded one page at a time as soon as any segment's page has been read,
+    so items are not yielded in any particular order.
+
+    Args:
+        table_name: The name of the DynamoDB table
+        total_segments: The number of segments into which the table is divided
+        max_workers: (Optional) The maximum number of threads used to scan segments.
+            Defaults to ``total_segments``.
+        **kwargs: Keyword arguments passed through to :meth:`DynamoDB.Table.scan`
+
+    Returns:
+        Iterator[dict]: A generator of scanned items
+    """
+    # boto3 resources are not thread-safe, so each worker thread creates its own table once;
+    # creating resources from a shared session is not thread-safe either, hence the lock
+    session = boto3.session.Session()
+    lock = threading.Lock()
+    local = threading.local()
+
+    def scan_page(segment, exclusive_start_key):
+        table = getattr(local, 'table', None)
+        if table is None:
+            with lock:
+                table = local.table = session.resource('dynamodb').Table(table_name)
+        page_kwargs = dict(kwargs, Segment=segment, TotalSegments=total_segments)
+        if exclusive_start_key:
+            page_kwargs['ExclusiveStartKey'] = exclusive_start_key
+        response = table.scan(**page_kwargs)
+        return segment, response.get('Items', []), response.get('LastEvaluatedKey')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or total_segments) as pool:
+        pending = {pool.submit(scan_page, segment, None) for segment in range(total_segments)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                segment, items, last_evaluated_key = future.result()
+                if last_evaluated_key:
+                    pending.add(pool.submit(scan_page, segment, last_evaluated_key))
+                yield from items
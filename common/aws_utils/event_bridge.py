@@ -0,0 +1,277 @@
+import collections
+import concurrent.futures
+import functools
+import json
+import os
+import random
+import threading
+import time
+import typing
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from common import exceptions
+from common.logging import setup_logger
+
+
+logger = setup_logger(__name__)
+
+MAX_ENTRIES_PER_REQUEST = 10
+MAX_REQUEST_SIZE_BYTES = 256 * 1024
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE_SECONDS = 0.05
+DEFAULT_BACKOFF_MAX_SECONDS = 1.0
+MAX_FLUSH_METRICS = 100
+
+FlushMetrics = collections.namedtuple(
+    'FlushMetrics',
+    ('entries', 'size_bytes', 'requests', 'retried_entries', 'failed_entries', 'duration_ms'),
+)
+FlushMetrics.__doc__ = 'Metrics describing a single flush of buffered EventBridge entries'
+
+
+def get_entry_size(entry: dict) -> int:
+    """Calculates the size of a ``PutEvents`` request entry, as counted against the
+    :const:`MAX_REQUEST_SIZE_BYTES` limit
+
+    See Also:
+        https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+    """
+    size = 14 if entry.get('Time') is not None else 0
+    for field in ('Source', 'DetailType', 'Detail'):
+        if entry.get(field) is not None:
+            size += len(entry[field].encode('utf-8'))
+    for resource in entry.get('Resources', ()):
+        size += len(resource.encode('utf-8'))
+    return size
+
+
+class EventPublisher:
+    """Buffers EventBridge events and publishes them in as few ``PutEvents`` requests as possible.
+
+    Buffered entries are flushed as soon as the buffer holds :const:`MAX_ENTRIES_PER_REQUEST`
+    entries, whenever another entry would exceed :const:`MAX_REQUEST_SIZE_BYTES` bytes, and
+    whenever :meth:`flush` is called, which should happen at the end of every invocation
+    (see :func:`publishes_events`). Metrics for only the :const:`MAX_FLUSH_METRICS` most
+    recently sent batches are kept in :attr:`flush_metrics`, so that a publisher may be shared
+    across the invocations of a warm Lambda container.
+
+    If ``background`` is ``True``, full batches are sent on a background thread so that
+    publishing does not block the handler; :meth:`flush` waits for those sends to complete.
+
+    Only the entries that EventBridge reports as failed are retried.
+
+    Examples:
+        .. code-block:: python
+
+            >>> publisher = EventPublisher()
+            >>> publisher.publish('OrderShipped', {'order_id': 1234})
+            >>> publisher.flush()
+            FlushMetrics(entries=1, size_bytes=75, requests=1, retried_entries=0, ...)
+    """
+
+    def __init__(
+        self,
+        source: typing.Optional[str] = None,
+        event_bus_name: typing.Optional[str] = None,
+        background: bool = False,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        """Initializes a new EventPublisher
+
+        Args:
+            source: The ``Source`` of published events.
+                Defaults to the value of the ``EVENT_BRIDGE_SOURCE`` environment variable.
+            event_bus_name: (Optional) The name or ARN of the event bus that receives events.
+                If ``None``, the account's default event bus is used. Defaults to ``None``.
+            background: If ``True``, full batches are sent on a background thread.
+                Defaults to ``False``.
+            max_retries: Maximum number of times failed entries are retried
+        """
+        self.source = source or os.environ['EVENT_BRIDGE_SOURCE']
+        self.event_bus_name = event_bus_name
+        self.max_retries = max_retries
+        self.flush_metrics = collections.deque(maxlen=MAX_FLUSH_METRICS)
+
+        self._client = boto3.client('events')
+        self._buffer = []
+        self._buffer_size = 0
+        self._lock = threading.Lock()
+        self._executor = (
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) if background else None
+        )
+        self._pending_sends = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def publish(self, detail_type: str, detail: typing.Any, resources: typing.Sequence[str] = ()):
+        """Adds an event to the buffer, first flushing the buffer if it cannot hold the event
+
+        Args:
+            detail_type: The ``DetailType`` of the event
+            detail: JSON-serializable event detail
+            resources: (Optional) ARNs of AWS resources that the event primarily concerns
+
+        Raises:
+            ValueError: If the event alone exceeds :const:`MAX_REQUEST_SIZE_BYTES`
+            exceptions.EventPublishError: If a synchronous flush of the full buffer
+                still failed after ``max_retries`` retries
+        """
+        entry = {'Source': self.source, 'DetailType': detail_type, 'Detail': json.dumps(detail)}
+        if resources:
+            entry['Resources'] = list(resources)
+        if self.event_bus_name:
+            entry['EventBusName'] = self.event_bus_name
+
+        entry_size = get_entry_size(entry)
+        if entry_size > MAX_REQUEST_SIZE_BYTES:
+            raise ValueError(
+                f'Event of {entry_size} bytes exceeds the {MAX_REQUEST_SIZE_BYTES} byte limit'
+            )
+
+        with self._lock:
+            if self._buffer_size + entry_size > MAX_REQUEST_SIZE_BYTES:
+                self._dispatch_buffer()
+            self._buffer.append(entry)
+            self._buffer_size += entry_size
+            if len(self._buffer) >= MAX_ENTRIES_PER_REQUEST:
+                self._dispatch_buffer()
+
+    def flush(self) -> typing.Optional[FlushMetrics]:
+        """Sends all buffered entries and waits for any background sends to complete
+
+        Returns:
+            FlushMetrics: Metrics for the batch sent by this call,
+                or ``None`` if no entries were buffered
+
+        Raises:
+            exceptions.EventPublishError: If any entries, including those sent in the background,
+                still failed after ``max_retries`` retries
+        """
+        with self._lock:
+            entries, self._buffer, self._buffer_size = self._buffer, [], 0
+            pending_sends, self._pending_sends = self._pending_sends, []
+
+        # Every pending send is awaited and the buffer is always sent, even if an earlier
+        # send failed, so that no entries are silently dropped
+        errors = []
+        for future in pending_sends:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+
+        metrics = None
+        if entries:
+            try:
+                metrics = self._send(entries)
+            except Exception as e:
+                errors.append(e)
+
+        if errors:
+            raise exceptions.EventPublishError(
+                '; '.join(str(e) for e in errors),
+                failed_entries=[
+                    entry for e in errors for entry in getattr(e, 'failed_entries', ())
+                ],
+            ) from errors[0]
+        return metrics
+
+    def _dispatch_buffer(self):
+        # Callers must hold `self._lock`
+        entries, self._buffer, self._buffer_size = self._buffer, [], 0
+        if self._executor is None:
+            self._send(entries)
+        else:
+            self._pending_sends.append(self._executor.submit(self._send, entries))
+
+    def _send(self, entries: typing.List[dict]) -> FlushMetrics:
+        started_at = time.monotonic()
+        entry_count = len(entries)
+        size_bytes = sum(get_entry_size(entry) for entry in entries)
+        requests = retried_entries = 0
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                retried_entries += len(entries)
+                backoff = DEFAULT_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)
+                time.sleep(random.uniform(0, min(DEFAULT_BACKOFF_MAX_SECONDS, backoff)))
+
+            requests += 1
+            try:
+                response = self._client.put_events(Entries=entries)
+            except (BotoCoreError, ClientError) as e:
+                # The request failed as a whole (e.g. throttling after the SDK's own retries),
+                # so every entry in it is retried
+                logger.warning(f'PutEvents request for {len(entries)} event(s) failed: {e}')
+                continue
+            if not response.get('FailedEntryCount'):
+                entries = []
+                break
+
+            # Response entries are in the same order as request entries
+            entries = [
+                entry
+                for entry, result in zip(entries, response['Entries'])
+                if result.get('ErrorCode')
+            ]
+
+        metrics = FlushMetrics(
+            entries=entry_count,
+            size_bytes=size_bytes,
+            requests=requests,
+            retried_entries=retried_entries,
+            failed_entries=len(entries),
+            duration_ms=round((time.monotonic() - started_at) * 1000, 3),
+        )
+        self.flush_metrics.append(metrics)
+        logger.info(
+            f'Published {entry_count - len(entries)} of {entry_count} EventBridge event(s) '
+            f'in {requests} request(s)',
+            extra={'event_bridge_flush': metrics._asdict()},
+        )
+
+        if entries:
+            raise exceptions.EventPublishError(
+                f'{len(entries)} event(s) could not be published after {self.max_retries} retries',
+                failed_entries=entries,
+            )
+        return metrics
+
+
+def publishes_events(publisher: EventPublisher) -> typing.Callable:
+    """Decorator for Lambda handler functions that flushes the given :class:`EventPublisher`
+    at the end of every invocation, regardless of whether the handler raised an exception.
+
+    If the handler raised an exception, a failure to flush is logged and the handler's own
+    exception is re-raised. If the handler succeeded, a failure to flush raises
+    :class:`~exceptions.EventPublishError` even though the handler's work has already been
+    done; the invocation may then be retried, so handlers using this decorator should be
+    idempotent (see :func:`~common.aws_utils.idempotency.idempotent`).
+    """
+
+    def decorator(fn: typing.Callable) -> typing.Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                try:
+                    publisher.flush()
+                except Exception:
+                    logger.exception('Failed to flush EventBridge events after handler error')
+                raise
+            publisher.flush()
+            return result
+
+        return wrapper
+
+    return decorator
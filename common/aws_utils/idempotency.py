@@ -0,0 +1,273 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import typing
+
+import boto3
+from botocore.exceptions import ClientError
+
+from common import exceptions
+from common.aws_utils import api_gateway
+from common.logging import setup_logger
+
+
+logger = setup_logger(__name__)
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+STATUS_IN_PROGRESS = 'IN_PROGRESS'
+STATUS_COMPLETED = 'COMPLETED'
+DEFAULT_EXPIRES_AFTER_SECONDS = 60 * 60
+DEFAULT_IN_PROGRESS_EXPIRES_AFTER_SECONDS = 5 * 60
+DEFAULT_CACHE_SIZE = 256
+
+
+class ResponseCache:
+    """A thread-safe, bounded, least-recently-used cache of completed responses
+    (and the payload hashes of the requests that produced them),
+    each of which expires at a given (epoch) time
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._responses = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> typing.Optional[dict]:
+        with self._lock:
+            try:
+                expires_at, response = self._responses[key]
+            except KeyError:
+                return None
+            if expires_at <= time.time():
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+            return response
+
+    def set(self, key: str, response: dict, expires_at: float):
+        with self._lock:
+            self._responses[key] = (expires_at, response)
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+    def __len__(self):
+        return len(self._responses)
+
+
+def _canonical_hash(value: typing.Any) -> str:
+    canonical_value = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical_value.encode('utf-8')).hexdigest()
+
+
+def get_payload_hash(event: dict) -> str:
+    """Returns a SHA-256 digest of a canonical JSON form of an invocation event's payload,
+    so that logically identical payloads produce the same hash regardless of key order
+    or whitespace
+
+    Args:
+        event: The API Gateway invocation event that provides incoming request data.
+            The body may be either a JSON string or an already-deserialized value
+            (see :func:`~api_gateway.requires_json_payload`).
+
+    Returns:
+        str: A hexadecimal payload hash
+    """
+    body = event.get('body')
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except json.JSONDecodeError:
+            pass
+    return _canonical_hash(body)
+
+
+def get_idempotency_key(event: dict) -> str:
+    """Derives an idempotency key for an API Gateway invocation event.
+
+    The key is a SHA-256 digest of the request's principal, HTTP method, path (rather than
+    resource, so that e.g. ``/v1/users/1`` and ``/v1/users/2`` never share a key) and
+    querystring parameters, combined with either the ``Idempotency-Key`` header (if provided)
+    or the request's :func:`get_payload_hash`.
+
+    Args:
+        event: The API Gateway invocation event that provides incoming request data
+
+    Returns:
+        str: A hexadecimal idempotency key
+    """
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    authorizer = (event.get('requestContext') or {}).get('authorizer') or {}
+
+    client_key = headers.get(IDEMPOTENCY_KEY_HEADER.lower())
+    identity = ['key', client_key] if client_key else ['payload', get_payload_hash(event)]
+
+    return _canonical_hash(
+        [
+            authorizer.get('principalId'),
+            event.get('httpMethod'),
+            event.get('path') or event.get('resource'),
+            event.get('queryStringParameters') or {},
+            identity,
+        ]
+    )
+
+
+def _check_payload_hash(key: str, stored_payload_hash: typing.Optional[str], payload_hash: str):
+    if stored_payload_hash is not None and stored_payload_hash != payload_hash:
+        raise exceptions.IdempotencyKeyMismatchError(
+            f'Idempotency key {key} was already used with a different request payload'
+        )
+
+
+def _delete_record(table, key: str):
+    """Deletes an idempotency record so that its request may be retried, logging any failure
+    rather than letting it replace the exception or response being returned
+    """
+    try:
+        table.delete_item(Key={'id': key})
+    except Exception:
+        logger.exception(f'Failed to delete idempotency record {key}')
+
+
+def _restore_response(stored_response: dict) -> api_gateway.HTTPResponse:
+    headers = dict(stored_response['headers'], **{REPLAYED_HEADER: 'true'})
+    response = api_gateway.HTTPResponse(
+        status_code=int(stored_response['statusCode']), extra_headers=headers
+    )
+    response['body'] = stored_response['body']
+    return response
+
+
+def idempotent(
+    table_name: typing.Optional[str] = None,
+    expires_after_seconds: int = DEFAULT_EXPIRES_AFTER_SECONDS,
+    in_progress_expires_after_seconds: int = DEFAULT_IN_PROGRESS_EXPIRES_AFTER_SECONDS,
+    cache: typing.Optional[ResponseCache] = None,
+) -> typing.Callable:
+    """Decorator factory for API Gateway handler functions that makes repeated requests
+    (e.g. client or API Gateway retries) return the original response instead of re-running
+    the handler.
+
+    Each request is identified by :func:`get_idempotency_key`. Repeats whose payload differs
+    from the original request's (i.e. a reused ``Idempotency-Key`` header) are rejected with
+    a ``422`` status code rather than replaying an unrelated response. Before the handler runs,
+    an ``IN_PROGRESS`` record is conditionally written to DynamoDB; once it returns,
+    the record is replaced with the ``COMPLETED`` :class:`~api_gateway.HTTPResponse`.
+    Completed responses are also held in a bounded in-process :class:`ResponseCache`,
+    so repeats that reach the same warm container never call DynamoDB.
+
+    Responses with a ``5xx`` status code and handler exceptions are not stored,
+    so such requests may be retried.
+
+    The DynamoDB table must have a string partition key named ``id`` and should have
+    TTL enabled on the numeric ``expiration`` attribute.
+
+    Examples:
+        .. code-block:: python
+
+            @api_gateway.format_errors
+            @idempotency.idempotent()
+            @api_gateway.requires_json_payload
+            def create_order__http(event, context):
+                ...
+
+    Args:
+        table_name: The name of the DynamoDB table holding idempotency records.
+            Defaults to the value of the ``IDEMPOTENCY_TABLE_NAME`` environment variable.
+        expires_after_seconds: Number of seconds for which completed responses are replayed
+        in_progress_expires_after_seconds: Number of seconds after which an ``IN_PROGRESS``
+            record is considered abandoned (e.g. because its invocation timed out)
+        cache: (Optional) The in-process cache of completed responses.
+            Defaults to a new :class:`ResponseCache` for the decorated handler.
+
+    Raises:
+        exceptions.IdempotencyConflictError: If a request with the same idempotency key
+            is still in progress
+        exceptions.IdempotencyKeyMismatchError: If the idempotency key was already used
+            with a different request payload
+    """
+    cache = ResponseCache() if cache is None else cache
+
+    def decorator(fn: typing.Callable) -> typing.Callable:
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            key = get_idempotency_key(event)
+            payload_hash = get_payload_hash(event)
+
+            cached = cache.get(key)
+            if cached is not None:
+                _check_payload_hash(key, cached['payload_hash'], payload_hash)
+                logger.info(f'Replaying cached response for idempotency key {key}')
+                return _restore_response(cached['response'])
+
+            table = boto3.resource('dynamodb').Table(
+                table_name or os.environ['IDEMPOTENCY_TABLE_NAME']
+            )
+            now = int(time.time())
+            try:
+                table.put_item(
+                    Item={
+                        'id': key,
+                        'status': STATUS_IN_PROGRESS,
+                        'payload_hash': payload_hash,
+                        'expiration': now + in_progress_expires_after_seconds,
+                    },
+                    ConditionExpression='attribute_not_exists(id) OR expiration < :now',
+                    ExpressionAttributeValues={':now': now},
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                record = table.get_item(Key={'id': key}, ConsistentRead=True).get('Item')
+                if record is not None:
+                    _check_payload_hash(key, record.get('payload_hash'), payload_hash)
+                if record is None or record['status'] == STATUS_IN_PROGRESS:
+                    raise exceptions.IdempotencyConflictError(
+                        'A request with the same idempotency key is already in progress'
+                    )
+                stored_response = json.loads(record['response'])
+                cache.set(
+                    key,
+                    {'payload_hash': record.get('payload_hash'), 'response': stored_response},
+                    float(record['expiration']),
+                )
+                logger.info(f'Replaying stored response for idempotency key {key}')
+                return _restore_response(stored_response)
+
+            try:
+                response = fn(event, context)
+            except Exception:
+                _delete_record(table, key)
+                raise
+
+            if int(response['statusCode']) >= 500:
+                _delete_record(table, key)
+                return response
+
+            expires_at = int(time.time()) + expires_after_seconds
+            stored_response = dict(response)
+            table.put_item(
+                Item={
+                    'id': key,
+                    'status': STATUS_COMPLETED,
+                    'payload_hash': payload_hash,
+                    'expiration': expires_at,
+                    'response': json.dumps(stored_response),
+                }
+            )
+            cache.set(key, {'payload_hash': payload_hash, 'response': stored_response}, expires_at)
+            return response
+
+        return wrapper
+
+    return decorator
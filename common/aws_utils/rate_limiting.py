@@ -0,0 +1,287 @@
+import collections
+import decimal
+import functools
+import math
+import os
+import threading
+import time
+import typing
+
+import boto3
+from botocore.exceptions import ClientError
+
+from common import exceptions
+from common.logging import setup_logger
+
+
+logger = setup_logger(__name__)
+
+DEFAULT_LEASE_SIZE = 10
+DEFAULT_MAX_LOCAL_BUCKETS = 1024
+DEFAULT_MAX_LEASE_ATTEMPTS = 5
+
+_LocalBucket = collections.namedtuple(
+    '_LocalBucket', ('tokens', 'leased_until', 'throttled_until')
+)
+
+
+def get_principal_id(event: dict) -> str:
+    """Returns the ``principalId`` provided by the API Gateway authorizer for an invocation event,
+    or ``"unknown_user"`` if the request was not authorized with a principal
+    """
+    authorizer = (event.get('requestContext') or {}).get('authorizer') or {}
+    return str(authorizer.get('principalId') or 'unknown_user')
+
+
+def _to_decimal(value: float) -> decimal.Decimal:
+    # boto3 only accepts Decimals for DynamoDB numbers
+    return decimal.Decimal(str(round(value, 6)))
+
+
+class TokenBucketRateLimiter:
+    """Limits each principal to ``limit`` requests per ``period`` seconds.
+
+    Every principal has a token bucket in DynamoDB that holds at most ``limit`` tokens and is
+    refilled continuously at a rate of ``limit / period`` tokens per second, so a principal may
+    burst up to ``limit`` requests but never sustain more than ``limit`` requests per ``period``.
+    Rather than spending one token per request with a network call, each container leases
+    up to ``lease_size`` tokens at a time (refilling the bucket and taking the tokens with
+    a conditional ``UpdateItem``) and then spends them from an in-process bucket.
+    DynamoDB is only called again once the local bucket is empty, so most requests are admitted
+    without leaving the container. Once a principal is throttled, the container rejects its
+    requests from memory until the shared bucket will have refilled a token.
+
+    Leased tokens that are not spent within the time it takes to refill a whole lease
+    are forfeited, so that idle containers cannot hoard tokens; ``lease_size`` therefore
+    bounds how far below ``limit`` a principal spread across many containers may be throttled.
+
+    The DynamoDB table must have a string partition key named ``id`` and should have
+    TTL enabled on the numeric ``expiration`` attribute.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        period: int = 60,
+        lease_size: int = DEFAULT_LEASE_SIZE,
+        scope: str = 'default',
+        table_name: typing.Optional[str] = None,
+        max_local_buckets: int = DEFAULT_MAX_LOCAL_BUCKETS,
+    ):
+        """Initializes a new TokenBucketRateLimiter
+
+        Args:
+            limit: The capacity of each principal's bucket, i.e. the number of requests
+                each principal may make per ``period``
+            period: The number of seconds it takes to refill an empty bucket
+            lease_size: The maximum number of tokens leased from DynamoDB at a time
+            scope: A name that distinguishes this limit from others sharing the same table
+            table_name: The name of the DynamoDB table holding token buckets.
+                Defaults to the value of the ``RATE_LIMIT_TABLE_NAME`` environment variable.
+            max_local_buckets: The maximum number of principals whose leased tokens
+                are held in memory; the least recently used are evicted first
+        """
+        self.limit = limit
+        self.period = period
+        self.lease_size = max(1, min(lease_size, limit))
+        self.scope = scope
+        self.table_name = table_name
+        self.max_local_buckets = max_local_buckets
+
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def refill_rate(self) -> float:
+        """The number of tokens added to each principal's bucket per second"""
+        return self.limit / self.period
+
+    def _take_local_token(self, principal_id: str, now: float) -> typing.Tuple[bool, float]:
+        """Spends one of the principal's leased tokens, if possible
+
+        Returns:
+            tuple: Whether a token was spent, and the time until which the principal is
+                throttled. If neither, more tokens must be leased.
+        """
+        with self._lock:
+            bucket = self._buckets.get(principal_id)
+            if bucket is None:
+                return False, 0.0
+            self._buckets.move_to_end(principal_id)
+            if now < bucket.throttled_until or bucket.tokens <= 0 or now >= bucket.leased_until:
+                return False, bucket.throttled_until
+            self._buckets[principal_id] = bucket._replace(tokens=bucket.tokens - 1)
+            return True, bucket.throttled_until
+
+    def _store_local_bucket(self, principal_id: str, bucket: _LocalBucket):
+        with self._lock:
+            self._buckets[principal_id] = bucket
+            self._buckets.move_to_end(principal_id)
+            while len(self._buckets) > self.max_local_buckets:
+                self._buckets.popitem(last=False)
+
+    def _lease_tokens(self, principal_id: str, now: float) -> typing.Tuple[int, float]:
+        """Refills the principal's bucket in DynamoDB and leases up to :attr:`lease_size`
+        tokens from it. The bucket is written conditionally on its ``version`` being unchanged
+        since it was read, and the lease is retried if another container changed it first.
+
+        Returns:
+            tuple: The number of tokens granted (which may be ``0``) and the number of tokens
+                left in the bucket
+        """
+        table = boto3.resource('dynamodb').Table(
+            self.table_name or os.environ['RATE_LIMIT_TABLE_NAME']
+        )
+        key = {'id': f'{self.scope}#{principal_id}'}
+
+        for _ in range(DEFAULT_MAX_LEASE_ATTEMPTS):
+            bucket = table.get_item(Key=key, ConsistentRead=True).get('Item')
+            if bucket is None:
+                available = float(self.limit)
+                version = 0
+                condition = {'ConditionExpression': 'attribute_not_exists(id)'}
+            else:
+                elapsed = max(0.0, now - float(bucket['refilled_at']))
+                available = min(
+                    float(self.limit), float(bucket['tokens']) + elapsed * self.refill_rate
+                )
+                version = int(bucket['version'])
+                condition = {
+                    'ConditionExpression': '#version = :previous_version',
+                    'ExpressionAttributeValues': {':previous_version': version},
+                }
+
+            granted = min(self.lease_size, int(available))
+            if not granted:
+                # Nothing is written, so throttled requests cost a single read
+                return 0, available
+
+            condition.setdefault('ExpressionAttributeValues', {}).update(
+                {
+                    ':tokens': _to_decimal(available - granted),
+                    ':refilled_at': _to_decimal(now),
+                    ':version': version + 1,
+                    # The bucket is full again once ``period`` seconds have passed, so an item
+                    # that has expired is equivalent to one that does not exist
+                    ':expiration': math.ceil(now) + self.period,
+                }
+            )
+            try:
+                table.update_item(
+                    Key=key,
+                    UpdateExpression=(
+                        'SET #tokens = :tokens, #refilled_at = :refilled_at, '
+                        '#version = :version, expiration = :expiration'
+                    ),
+                    ExpressionAttributeNames={
+                        '#tokens': 'tokens',
+                        '#refilled_at': 'refilled_at',
+                        '#version': 'version',
+                    },
+                    **condition,
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                logger.debug(f'Token bucket for {principal_id} changed concurrently; retrying')
+                continue
+            return granted, available - granted
+
+        logger.warning(
+            f'Could not lease tokens for {principal_id} after {DEFAULT_MAX_LEASE_ATTEMPTS} '
+            f'attempts ({self.scope})'
+        )
+        return 0, 0.0
+
+    def acquire(self, principal_id: str):
+        """Spends one of the principal's tokens
+
+        Args:
+            principal_id: The principal making the request
+
+        Raises:
+            exceptions.TooManyRequests: If the principal's bucket is empty
+        """
+        now = time.time()
+        taken, throttled_until = self._take_local_token(principal_id, now)
+        if taken:
+            return
+
+        if now >= throttled_until:
+            granted, available = self._lease_tokens(principal_id, now)
+            if granted:
+                self._store_local_bucket(
+                    principal_id,
+                    _LocalBucket(
+                        tokens=granted - 1,
+                        leased_until=now + self.lease_size / self.refill_rate,
+                        throttled_until=0.0,
+                    ),
+                )
+                return
+
+            throttled_until = now + (1 - available) / self.refill_rate
+            self._store_local_bucket(
+                principal_id,
+                _LocalBucket(tokens=0, leased_until=now, throttled_until=throttled_until),
+            )
+            logger.info(
+                f'Throttling {principal_id} for {throttled_until - now:.3f} second(s) '
+                f'({self.scope})'
+            )
+
+        raise exceptions.TooManyRequests(
+            f'Rate limit of {self.limit} requests per {self.period} seconds exceeded',
+            retry_after=max(1, math.ceil(throttled_until - now)),
+        )
+
+
+def rate_limited(
+    limit: int,
+    period: int = 60,
+    lease_size: int = DEFAULT_LEASE_SIZE,
+    scope: typing.Optional[str] = None,
+    table_name: typing.Optional[str] = None,
+) -> typing.Callable:
+    """Decorator factory for API Gateway handler functions that limits each authorized principal
+    to ``limit`` requests per ``period`` seconds (see :class:`TokenBucketRateLimiter`).
+
+    Throttled requests raise :class:`~exceptions.TooManyRequests`, which
+    :func:`~api_gateway.format_errors` turns into a ``429`` response with a ``Retry-After`` header.
+
+    Examples:
+        .. code-block:: python
+
+            @api_gateway.format_errors
+            @rate_limiting.rate_limited(limit=100, period=60)
+            def expensive__http(event, context):
+                ...
+
+    Args:
+        limit: The number of requests each principal may make per ``period``
+        period: The number of seconds it takes to refill each principal's empty bucket
+        lease_size: The maximum number of tokens leased from DynamoDB at a time
+        scope: (Optional) A name that distinguishes this limit from others sharing the same
+            table. Defaults to the decorated function's qualified name.
+        table_name: The name of the DynamoDB table holding token buckets.
+            Defaults to the value of the ``RATE_LIMIT_TABLE_NAME`` environment variable.
+    """
+
+    def decorator(fn: typing.Callable) -> typing.Callable:
+        limiter = TokenBucketRateLimiter(
+            limit=limit,
+            period=period,
+            lease_size=lease_size,
+            scope=scope or f'{fn.__module__}.{fn.__qualname__}',
+            table_name=table_name,
+        )
+
+        @functools.wraps(fn)
+        def wrapper(event, context):
+            limiter.acquire(get_principal_id(event))
+            return fn(event, context)
+
+        wrapper.rate_limiter = limiter
+        return wrapper
+
+    return decorator
@@ -0,0 +1,202 @@
+import typing
+
+from common import exceptions
+from common.aws_utils import api_gateway
+from common.logging import setup_logger
+
+
+logger = setup_logger(__name__)
+
+
+class _RouteNode:
+    """A node in a :class:`Router`'s path trie, representing a single path segment"""
+
+    __slots__ = (
+        'static_children',
+        'parameter_name',
+        'parameter_child',
+        'greedy_name',
+        'handlers',
+        'resources',
+    )
+
+    def __init__(self):
+        self.static_children = {}
+        self.parameter_name = None
+        self.parameter_child = None
+        self.greedy_name = None
+        self.handlers = {}
+        self.resources = {}
+
+
+def _split_path(path: str) -> typing.List[str]:
+    return [segment for segment in path.split('/') if segment]
+
+
+class Router:
+    """Dispatches API Gateway invocation events to registered handler functions
+    by HTTP method and resource path, so that a single Lambda function can serve many endpoints.
+
+    Routes use API Gateway's resource path syntax: ``{name}`` matches a single path segment
+    and ``{name+}`` matches all remaining segments. As API Gateway would for a resource of its
+    own, the router adds matched values to the event's ``pathParameters`` and sets the event's
+    ``resource`` to the matched route's resource path. Every registered handler is wrapped with
+    :func:`~api_gateway.format_errors`.
+
+    Routes are compiled when they are registered: a dictionary keyed by method and resource
+    serves events whose ``resource`` API Gateway has already resolved, while a trie of path
+    segments serves events from a catch-all (e.g. ``/{proxy+}``) resource.
+
+    Examples:
+        .. code-block:: python
+
+            router = Router()
+
+            @router.route('GET', '/v1/things/{thing_id}')
+            def get_thing__http(event, context):
+                thing_id = event['pathParameters']['thing_id']
+                ...
+
+            handle__http = router.handle
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._root = _RouteNode()
+
+    def add_route(self, method: str, resource: str, handler: typing.Callable) -> typing.Callable:
+        """Registers a handler function for the given HTTP method and resource path
+
+        Args:
+            method: The HTTP method, e.g. ``"GET"``, or ``"ANY"`` to match every method
+            resource: The resource path, e.g. ``"/v1/things/{thing_id}"``
+            handler: The API Gateway handler function
+
+        Returns:
+            Callable: The given handler, wrapped with :func:`~api_gateway.format_errors`
+
+        Raises:
+            ValueError: If a handler is already registered for the method and resource,
+                or if the resource conflicts with the parameter names of another resource
+        """
+        method = method.upper()
+        resource = '/' + '/'.join(_split_path(resource))
+        if (method, resource) in self._routes:
+            raise ValueError(f'A handler is already registered for {method} {resource}')
+
+        node = self._root
+        is_greedy = False
+        for segment in _split_path(resource):
+            if segment.startswith('{') and segment.endswith('+}'):
+                name = segment[1:-2]
+                if node.greedy_name not in (None, name):
+                    raise ValueError(f'Conflicting greedy path parameter in {resource}')
+                node.greedy_name = name
+                is_greedy = True
+                break
+            elif segment.startswith('{') and segment.endswith('}'):
+                name = segment[1:-1]
+                if node.parameter_name not in (None, name):
+                    raise ValueError(f'Conflicting path parameter {segment} in {resource}')
+                if node.parameter_child is None:
+                    node.parameter_name, node.parameter_child = name, _RouteNode()
+                node = node.parameter_child
+            else:
+                node = node.static_children.setdefault(segment, _RouteNode())
+
+        wrapped_handler = api_gateway.format_errors(handler)
+        kind = '+' if is_greedy else ''
+        node.handlers.setdefault(kind, {})[method] = wrapped_handler
+        node.resources[kind] = resource
+        self._routes[(method, resource)] = wrapped_handler
+        return wrapped_handler
+
+    def route(self, method: str, resource: str) -> typing.Callable:
+        """Decorator that registers a handler function (see :meth:`add_route`)"""
+
+        def decorator(fn: typing.Callable) -> typing.Callable:
+            return self.add_route(method, resource, fn)
+
+        return decorator
+
+    def _match(
+        self, path: str
+    ) -> typing.Tuple[typing.Optional[dict], typing.Optional[str], typing.Dict[str, str]]:
+        """Finds the handlers (keyed by method) for a request path, the resource path
+        of the matched routes and their path parameters
+        """
+        path_parameters = {}
+        match = self._match_segments(self._root, _split_path(path), 0, path_parameters)
+        if match is None:
+            return None, None, {}
+        node, kind = match
+        return node.handlers[kind], node.resources[kind], path_parameters
+
+    def _match_segments(
+        self, node: _RouteNode, segments: typing.List[str], index: int, path_parameters: dict
+    ) -> typing.Optional[typing.Tuple[_RouteNode, str]]:
+        """Depth-first search of the path trie that prefers static segments, then path parameters,
+        then greedy path parameters, backtracking whenever a more specific branch has no match
+
+        Returns:
+            tuple: The matched node and the kind of its matched routes (``''`` or ``'+'``),
+                or ``None`` if no route matches
+        """
+        if index == len(segments):
+            return (node, '') if '' in node.handlers else None
+
+        segment = segments[index]
+        static_child = node.static_children.get(segment)
+        if static_child is not None:
+            match = self._match_segments(static_child, segments, index + 1, path_parameters)
+            if match is not None:
+                return match
+
+        if node.parameter_child is not None:
+            path_parameters[node.parameter_name] = segment
+            match = self._match_segments(
+                node.parameter_child, segments, index + 1, path_parameters
+            )
+            if match is not None:
+                return match
+            del path_parameters[node.parameter_name]
+
+        if node.greedy_name:
+            path_parameters[node.greedy_name] = '/'.join(segments[index:])
+            return node, '+'
+        return None
+
+    def _resolve(self, event: dict) -> typing.Callable:
+        method = event['httpMethod'].upper()
+        resource = event.get('resource')
+
+        handler = self._routes.get((method, resource)) or self._routes.get(('ANY', resource))
+        if handler is not None:
+            return handler
+
+        handlers, matched_resource, path_parameters = self._match(
+            event.get('path') or resource or '/'
+        )
+        if handlers is None:
+            raise exceptions.HTTPNotFoundError(f'No route for {method} {event.get("path")}')
+
+        handler = handlers.get(method) or handlers.get('ANY')
+        if handler is None:
+            raise exceptions.MethodNotAllowed(
+                f'{method} is not allowed for {event.get("path")}', allowed_methods=handlers
+            )
+
+        event['resource'] = matched_resource
+        if path_parameters:
+            event['pathParameters'] = dict(event.get('pathParameters') or {}, **path_parameters)
+        return handler
+
+    @api_gateway.format_errors
+    def handle(self, event: dict, context: object) -> api_gateway.HTTPResponse:
+        """API Gateway handler function that dispatches the event to the matching route.
+
+        Responds with a ``404`` status code if no route matches the request path,
+        or with a ``405`` status code if routes match the request path
+        but none of them accept the request method.
+        """
+        return self._resolve(event)(event, context)
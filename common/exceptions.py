@@ -1,6 +1,10 @@
+import typing
+
+
 class HTTPError(Exception):
     status_code = NotImplemented
     description = NotImplemented
+    headers = None
 
 
 class HTTPNotFoundError(HTTPError):
@@ -23,10 +27,51 @@ class Unauthorized(HTTPError):
     description = 'Unauthorized'
 
 
+class MethodNotAllowed(HTTPError):
+    status_code = 405
+    description = 'Method Not Allowed'
+
+    def __init__(self, message: str, allowed_methods: typing.Iterable[str]):
+        super().__init__(message)
+        self.headers = {'Allow': ', '.join(sorted(allowed_methods))}
+
+
 class UnsupportedMediaType(HTTPError):
     status_code = 415
     description = 'Unsupported Media Type'
 
 
+class IdempotencyConflictError(HTTPError):
+    status_code = 409
+    description = 'Conflict with a request that is still in progress'
+
+
+class TooManyRequests(HTTPError):
+    status_code = 429
+    description = 'Too Many Requests'
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+class IdempotencyKeyMismatchError(HTTPError):
+    status_code = 422
+    description = 'Idempotency key was already used with a different request payload'
+
+
 class QuerystringParameterError(HTTPBadRequestError):
     pass
+
+
+class UnprocessedItemsError(ServerError):
+    def __init__(self, message: str, unprocessed: dict):
+        super().__init__(message)
+        self.unprocessed = unprocessed
+
+
+class EventPublishError(ServerError):
+    def __init__(self, message: str, failed_entries: list):
+        super().__init__(message)
+        self.failed_entries = failed_entries
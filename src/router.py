@@ -0,0 +1,23 @@
+from aws_xray_sdk.core import xray_recorder
+
+from common.aws_utils import api_gateway
+from common.aws_utils.routing import Router
+from src import handlers
+
+router = Router()
+router.add_route('GET', '/v1/greeting', handlers.get_greeting__http)
+
+
+@xray_recorder.capture()
+def route__http(event: dict, context: object) -> api_gateway.HTTPResponse:
+    """Dispatches an API Gateway event to the handler registered on :data:`router`
+    for its HTTP method and resource path
+
+    Routing several low-traffic endpoints through this single function lets them share
+    one warm container instead of each endpoint paying for its own cold starts.
+
+    :param event: The incoming API Gateway event
+    :param context: The current Lambda context
+    :return: The matched handler's response, or an error response if no handler matches
+    """
+    return router.handle(event, context)
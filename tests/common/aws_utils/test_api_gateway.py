@@ -1,9 +1,13 @@
+import decimal
 import http
 import json
+import os
+import urllib.parse
 
+import boto3
 import pytest
 
-from common.aws_utils import api_gateway
+from common.aws_utils import api_gateway, routing
 from common import exceptions
 
 
@@ -182,3 +186,241 @@ class TestRequiresJSONPayload:
         content = {'key': 'value'}
         processed_body = decorated({'body': json.dumps(content)}, None)
         assert processed_body == content
+
+
+class TestOffloadsLargeResponses:
+    BUCKET_NAME = 'offloaded-responses'
+
+    @pytest.fixture(autouse=True)
+    def bucket(self, monkeypatch):
+        monkeypatch.setenv('RESPONSE_OFFLOAD_BUCKET_NAME', self.BUCKET_NAME)
+        boto3.client('s3').create_bucket(
+            Bucket=self.BUCKET_NAME,
+            CreateBucketConfiguration={'LocationConstraint': 'us-west-2'},
+        )
+
+    def _get_offloaded_object(self, url):
+        path = urllib.parse.urlparse(url).path
+        key = path[path.index('responses/') :]
+        return boto3.client('s3').get_object(Bucket=self.BUCKET_NAME, Key=key)
+
+    def test_small_responses_are_unchanged(self):
+        response = api_gateway.HTTPResponse(body={'foo': 'bar'})
+        decorated = api_gateway.offloads_large_responses(threshold_bytes=1024)(
+            lambda e, c: response
+        )
+
+        assert decorated({}, None) is response
+
+    def test_large_responses_are_replaced_by_envelope(self):
+        body = ['x' * 100] * 20
+        decorated = api_gateway.offloads_large_responses(threshold_bytes=1024)(
+            lambda e, c: api_gateway.HTTPResponse(status_code=201, body=body)
+        )
+
+        response = decorated({}, None)
+        envelope = json.loads(response['body'])
+        offloaded = self._get_offloaded_object(envelope['url'])
+
+        assert response['statusCode'] == '201'
+        assert envelope['expires_in'] == api_gateway.DEFAULT_OFFLOAD_URL_EXPIRES_IN_SECONDS
+        assert envelope['content_length'] == len(json.dumps(body))
+        assert offloaded['ContentType'] == 'application/json'
+        assert json.loads(offloaded['Body'].read()) == body
+
+    def test_threshold_applies_to_serialized_response(self):
+        body = ['a'] * 150
+        response = api_gateway.HTTPResponse(body=body)
+        assert len(response['body']) < 1024 < len(json.dumps(response))
+
+        decorated = api_gateway.offloads_large_responses(threshold_bytes=1024)(
+            lambda e, c: response
+        )
+        envelope = json.loads(decorated({}, None)['body'])
+
+        assert json.loads(self._get_offloaded_object(envelope['url'])['Body'].read()) == body
+
+    def test_redirects_to_offloaded_body(self):
+        decorated = api_gateway.offloads_large_responses(threshold_bytes=10, redirect=True)(
+            lambda e, c: api_gateway.HTTPResponse(body='a long enough body')
+        )
+
+        response = decorated({}, None)
+
+        assert response['statusCode'] == '303'
+        assert response['body'] == ''
+        offloaded = self._get_offloaded_object(response['headers']['Location'])
+        assert offloaded['Body'].read() == b'"a long enough body"'
+
+    def test_uses_multipart_upload_for_bodies_larger_than_a_part(self, mocker):
+        part_size = 5 * 1024 * 1024
+        body = 'x' * (2 * part_size + 10)
+        decorated = api_gateway.offloads_large_responses(part_size=part_size)(
+            lambda e, c: api_gateway.HTTPResponse(body=body)
+        )
+        s3 = boto3.client('s3')
+        mocker.spy(s3, 'upload_part')
+        mocker.patch('boto3.client', return_value=s3)
+
+        response = decorated({}, None)
+
+        assert s3.upload_part.call_count == 3
+        offloaded = self._get_offloaded_object(json.loads(response['body'])['url'])
+        assert json.loads(offloaded['Body'].read()) == body
+
+    def test_aborts_failed_multipart_uploads(self, mocker):
+        part_size = 5 * 1024 * 1024
+        decorated = api_gateway.offloads_large_responses(part_size=part_size)(
+            lambda e, c: api_gateway.HTTPResponse(body='x' * (part_size + 1))
+        )
+        s3 = boto3.client('s3')
+        mocker.patch.object(s3, 'complete_multipart_upload', side_effect=RuntimeError('Oh no!'))
+        mocker.patch('boto3.client', return_value=s3)
+
+        with pytest.raises(RuntimeError):
+            decorated({}, None)
+
+        assert s3.list_multipart_uploads(Bucket=self.BUCKET_NAME).get('Uploads') is None
+
+
+class TestPaginate:
+    @pytest.fixture(autouse=True)
+    def cursor_secret_key(self, monkeypatch):
+        monkeypatch.setenv('PAGINATION_CURSOR_SECRET_KEY', 'cursor-secret')
+
+    @staticmethod
+    def _event(path='/v1/things', resource=None, **query_string_parameters):
+        return {
+            'resource': resource or path,
+            'path': path,
+            'queryStringParameters': query_string_parameters or None,
+        }
+
+    @staticmethod
+    def _next_query(body):
+        return dict(urllib.parse.parse_qsl(urllib.parse.urlparse(body['next']).query))
+
+    def test_pages_through_items_by_offset(self):
+        pulled = []
+
+        def get_items(after):
+            assert after is None
+            for i in range(7):
+                pulled.append(i)
+                yield {'id': i}
+
+        response = api_gateway.paginate(self._event(limit='3', sort='asc'), get_items)
+        body = json.loads(response['body'])
+
+        assert body['items'] == [{'id': 0}, {'id': 1}, {'id': 2}]
+        assert pulled == [0, 1, 2, 3]
+        assert self._next_query(body) == {'sort': 'asc', 'limit': '3', 'cursor': body['cursor']}
+        assert response['headers']['Link'] == f'<{body["next"]}>; rel="next"'
+
+        pages = [body['items']]
+        while body['next']:
+            body = json.loads(
+                api_gateway.paginate(self._event(**self._next_query(body)), get_items)['body']
+            )
+            pages.append(body['items'])
+
+        assert [[item['id'] for item in page] for page in pages] == [[0, 1, 2], [3, 4, 5], [6]]
+        assert body['cursor'] is None
+
+    def test_resumes_from_item_cursor(self):
+        calls = []
+
+        def get_items(after):
+            calls.append(after)
+            start = 0 if after is None else after['id'] + 1
+            return ({'id': i, 'score': decimal.Decimal('1.5')} for i in range(start, 10))
+
+        first = json.loads(
+            api_gateway.paginate(
+                self._event(limit='4'), get_items, get_cursor=lambda item: {'id': item['id']}
+            )['body']
+        )
+        second = json.loads(
+            api_gateway.paginate(
+                self._event(limit='4', cursor=first['cursor']),
+                get_items,
+                get_cursor=lambda item: {'id': item['id']},
+            )['body']
+        )
+
+        assert calls == [None, {'id': 3}]
+        assert [item['id'] for item in second['items']] == [4, 5, 6, 7]
+        assert second['items'][0]['score'] == 1.5
+
+    def test_last_page_has_no_next_link(self):
+        response = api_gateway.paginate(self._event(limit='2'), lambda after: iter([1, 2]))
+
+        assert json.loads(response['body']) == {'items': [1, 2], 'cursor': None, 'next': None}
+        assert 'Link' not in response['headers']
+
+    def test_uses_default_limit(self):
+        body = json.loads(
+            api_gateway.paginate(self._event(), lambda after: range(100), default_limit=5)['body']
+        )
+
+        assert body['items'] == [0, 1, 2, 3, 4]
+
+    @pytest.mark.parametrize('limit', ('0', '-1', 'ten', '1001'))
+    def test_rejects_invalid_limits(self, limit):
+        with pytest.raises(exceptions.QuerystringParameterError):
+            api_gateway.paginate(self._event(limit=limit), lambda after: [])
+
+    def test_rejects_tampered_cursors(self):
+        cursor = api_gateway.encode_cursor(10, path='/v1/things')
+        forged = api_gateway.encode_cursor(10, secret_key='another-secret', path='/v1/things')
+
+        assert api_gateway.decode_cursor(cursor, path='/v1/things') == 10
+        for invalid_cursor in (forged, cursor[:-2], 'not a cursor!'):
+            with pytest.raises(exceptions.QuerystringParameterError):
+                api_gateway.paginate(self._event(cursor=invalid_cursor), lambda after: [])
+
+    @pytest.mark.parametrize(
+        'other_path, other_resource',
+        (('/v1/widgets', None), ('/v1/things/2/parts', '/v1/things/{thing_id}/parts')),
+        ids=('another resource', 'another path parameter'),
+    )
+    def test_rejects_cursors_issued_for_another_path(self, other_path, other_resource):
+        response = api_gateway.paginate(
+            self._event('/v1/things/1/parts', '/v1/things/{thing_id}/parts', limit='1'),
+            lambda after: range(3),
+        )
+        offset_page = json.loads(response['body'])
+
+        with pytest.raises(exceptions.QuerystringParameterError):
+            api_gateway.paginate(
+                self._event(other_path, other_resource, cursor=offset_page['cursor']),
+                lambda after: [],
+                get_cursor=lambda item: {'id': item['id']},
+            )
+
+    def test_rejects_cursors_issued_for_another_routed_endpoint(self):
+        router = routing.Router()
+        router.add_route('GET', '/v1/a', lambda e, c: api_gateway.paginate(e, lambda _: range(3)))
+        router.add_route(
+            'GET',
+            '/v1/b',
+            lambda e, c: api_gateway.paginate(e, lambda _: [], get_cursor=lambda item: item),
+        )
+
+        def handle(path, **query_string_parameters):
+            return router.handle(
+                dict(self._event(path, '/{proxy+}', **query_string_parameters), httpMethod='GET'),
+                None,
+            )
+
+        cursor = json.loads(handle('/v1/a', limit='1')['body'])['cursor']
+
+        assert handle('/v1/b', cursor=cursor)['statusCode'] == '400'
+
+    def test_reads_secret_key_from_ssm(self, monkeypatch, secret_key):
+        monkeypatch.delenv('PAGINATION_CURSOR_SECRET_KEY')
+        monkeypatch.setenv(
+            'PAGINATION_CURSOR_SECRET_KEY__SSM_KEY', os.environ['THOR_API_SECRET_KEY__SSM_KEY']
+        )
+
+        assert api_gateway.encode_cursor(1) == api_gateway.encode_cursor(1, secret_key=secret_key)
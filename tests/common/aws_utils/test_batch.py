@@ -0,0 +1,129 @@
+import base64
+import json
+import threading
+
+import pytest
+
+from common.aws_utils import batch
+
+
+def _sqs_record(message_id, body, group_id=None):
+    record = {'messageId': message_id, 'body': json.dumps(body), 'attributes': {}}
+    if group_id:
+        record['attributes']['MessageGroupId'] = group_id
+    return record
+
+
+def _kinesis_record(sequence_number, data, partition_key, shard_id='shardId-000000000000'):
+    return {
+        'eventID': f'{shard_id}:{sequence_number}',
+        'eventSourceARN': 'arn:aws:kinesis:us-west-2:1234:stream/test',
+        'kinesis': {
+            'sequenceNumber': sequence_number,
+            'partitionKey': partition_key,
+            'data': base64.b64encode(json.dumps(data).encode()).decode(),
+        },
+    }
+
+
+class TestProcessesBatch:
+    def test_reports_only_failed_records(self):
+        @batch.processes_batch()
+        def handler(record, context):
+            if json.loads(batch.get_record_data(record))['fail']:
+                raise ValueError('Oh no!')
+
+        event = {'Records': [_sqs_record(str(i), {'fail': i in (1, 3)}) for i in range(5)]}
+
+        assert handler(event, None) == {
+            'batchItemFailures': [{'itemIdentifier': '1'}, {'itemIdentifier': '3'}]
+        }
+        assert handler.last_metrics.records == 5
+        assert handler.last_metrics.failed_records == 2
+
+    def test_processes_unordered_records_concurrently(self):
+        barrier = threading.Barrier(4, timeout=5)
+
+        @batch.processes_batch(max_workers=4)
+        def handler(record, context):
+            barrier.wait()
+
+        event = {'Records': [_sqs_record(str(i), {}) for i in range(4)]}
+
+        assert handler(event, None) == {'batchItemFailures': []}
+
+    def test_preserves_order_within_message_groups(self):
+        processed = []
+
+        @batch.processes_batch(max_workers=4)
+        def handler(record, context):
+            processed.append(json.loads(batch.get_record_data(record)))
+
+        event = {
+            'Records': [
+                _sqs_record(str(i), {'group': i % 2, 'index': i}, group_id=str(i % 2))
+                for i in range(20)
+            ]
+        }
+        handler(event, None)
+
+        for group in (0, 1):
+            assert [p['index'] for p in processed if p['group'] == group] == list(
+                range(group, 20, 2)
+            )
+
+    def test_skips_remaining_records_in_group_after_failure(self):
+        processed = []
+
+        @batch.processes_batch()
+        def handler(record, context):
+            data = json.loads(batch.get_record_data(record))
+            if data == {'fail': True}:
+                raise ValueError('Oh no!')
+            processed.append(record['kinesis']['sequenceNumber'])
+
+        event = {
+            'Records': [
+                _kinesis_record('1', {}, 'a'),
+                _kinesis_record('2', {'fail': True}, 'a'),
+                _kinesis_record('3', {}, 'a'),
+                _kinesis_record('4', {}, 'b'),
+            ]
+        }
+
+        assert handler(event, None) == {
+            'batchItemFailures': [{'itemIdentifier': '2'}, {'itemIdentifier': '3'}]
+        }
+        assert sorted(processed) == ['1', '4']
+
+    def test_records_metrics(self):
+        handler = batch.processes_batch()(lambda record, context: None)
+
+        handler({'Records': [_sqs_record(str(i), {}) for i in range(3)]}, None)
+
+        metrics = handler.last_metrics
+        assert metrics.records == 3
+        assert metrics.failed_records == 0
+        assert metrics.records_per_second > 0
+        assert 0 <= metrics.p50_latency_ms <= metrics.p99_latency_ms <= metrics.max_latency_ms
+
+    def test_handles_empty_batches(self):
+        handler = batch.processes_batch()(lambda record, context: None)
+
+        assert handler({'Records': []}, None) == {'batchItemFailures': []}
+
+
+@pytest.mark.parametrize(
+    'record, expected_key',
+    (
+        (_sqs_record('1', {}), None),
+        (_sqs_record('1', {}, group_id='g'), 'g'),
+        (
+            _kinesis_record('1', {}, 'pk', shard_id='shardId-1'),
+            'arn:aws:kinesis:us-west-2:1234:stream/test/shardId-1/pk',
+        ),
+    ),
+    ids=('standard SQS', 'FIFO SQS', 'Kinesis'),
+)
+def test_get_ordering_key(record, expected_key):
+    assert batch.get_ordering_key(record) == expected_key
@@ -0,0 +1,236 @@
+import decimal
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Key
+
+from common import exceptions
+from common.aws_utils import dynamodb
+
+
+TABLE_NAME = 'test-table'
+
+
+@pytest.fixture(autouse=True)
+def table():
+    return boto3.resource('dynamodb').create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[
+            {'AttributeName': 'pk', 'KeyType': 'HASH'},
+            {'AttributeName': 'sk', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'pk', 'AttributeType': 'S'},
+            {'AttributeName': 'sk', 'AttributeType': 'N'},
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    return mocker.patch('common.aws_utils.dynamodb.time.sleep')
+
+
+@pytest.fixture
+def items():
+    return [{'pk': f'p{i % 3}', 'sk': i, 'value': f'v{i}'} for i in range(130)]
+
+
+@pytest.fixture
+def mock_dynamodb_resource(mocker):
+    resource = mocker.Mock()
+    mocker.patch('boto3.resource', return_value=resource)
+    return resource
+
+
+class TestBatchWriteAndGet:
+    def test_round_trips_more_items_than_a_single_batch(self, items):
+        assert dynamodb.batch_write_items(TABLE_NAME, put_items=items) == 130
+
+        keys = [{'pk': item['pk'], 'sk': item['sk']} for item in items]
+        retrieved = dynamodb.batch_get_items(TABLE_NAME, keys + [{'pk': 'nope', 'sk': 0}])
+
+        assert sorted(retrieved, key=lambda item: item['sk']) == items
+
+    def test_deletes_items(self, items):
+        dynamodb.batch_write_items(TABLE_NAME, put_items=items[:5])
+        dynamodb.batch_write_items(TABLE_NAME, delete_keys=[{'pk': 'p0', 'sk': 0}])
+
+        assert len(list(dynamodb.scan(TABLE_NAME))) == 4
+
+    def test_chunks_requests(self, mock_dynamodb_resource, items):
+        mock_dynamodb_resource.batch_write_item.return_value = {'UnprocessedItems': {}}
+        mock_dynamodb_resource.batch_get_item.return_value = {'Responses': {}}
+
+        dynamodb.batch_write_items(TABLE_NAME, put_items=items)
+        dynamodb.batch_get_items(
+            TABLE_NAME, [{'pk': item['pk'], 'sk': item['sk']} for item in items]
+        )
+
+        write_sizes = [
+            len(call[1]['RequestItems'][TABLE_NAME])
+            for call in mock_dynamodb_resource.batch_write_item.call_args_list
+        ]
+        get_sizes = [
+            len(call[1]['RequestItems'][TABLE_NAME]['Keys'])
+            for call in mock_dynamodb_resource.batch_get_item.call_args_list
+        ]
+        assert write_sizes == [25, 25, 25, 25, 25, 5]
+        assert get_sizes == [100, 30]
+
+    def test_retries_unprocessed_keys(self, mock_dynamodb_resource, no_backoff):
+        keys = [{'pk': 'a', 'sk': 1}, {'pk': 'b', 'sk': 2}]
+        mock_dynamodb_resource.batch_get_item.side_effect = [
+            {
+                'Responses': {TABLE_NAME: [dict(keys[0], value=1)]},
+                'UnprocessedKeys': {TABLE_NAME: {'Keys': [keys[1]]}},
+            },
+            {'Responses': {TABLE_NAME: [dict(keys[1], value=2)]}, 'UnprocessedKeys': {}},
+        ]
+
+        retrieved = dynamodb.batch_get_items(TABLE_NAME, keys)
+
+        assert retrieved == [dict(keys[0], value=1), dict(keys[1], value=2)]
+        assert mock_dynamodb_resource.batch_get_item.call_args_list[1][1] == {
+            'RequestItems': {TABLE_NAME: {'Keys': [keys[1]]}}
+        }
+        assert no_backoff.call_count == 1
+
+    def test_raises_error_when_unprocessed_items_exhaust_retries(self, mock_dynamodb_resource):
+        unprocessed = {TABLE_NAME: [{'PutRequest': {'Item': {'pk': 'a', 'sk': 1}}}]}
+        mock_dynamodb_resource.batch_write_item.return_value = {'UnprocessedItems': unprocessed}
+
+        with pytest.raises(exceptions.UnprocessedItemsError) as ctx:
+            dynamodb.batch_write_items(TABLE_NAME, put_items=[{'pk': 'a', 'sk': 1}], max_retries=2)
+
+        assert ctx.value.unprocessed == unprocessed
+        assert mock_dynamodb_resource.batch_write_item.call_count == 3
+
+
+class TestPagination:
+    def test_query_follows_last_evaluated_key(self, items):
+        dynamodb.batch_write_items(TABLE_NAME, put_items=items)
+
+        results = dynamodb.query(TABLE_NAME, KeyConditionExpression=Key('pk').eq('p1'), Limit=7)
+
+        assert [item['sk'] for item in results] == list(range(1, 130, 3))
+
+    def test_scan_is_lazy(self, mock_dynamodb_resource):
+        scan = mock_dynamodb_resource.Table.return_value.scan
+        scan.side_effect = [{'Items': [{'pk': 'a'}], 'LastEvaluatedKey': {'pk': 'a'}}]
+
+        results = dynamodb.scan(TABLE_NAME)
+        assert next(results) == {'pk': 'a'}
+        assert scan.call_count == 1
+
+    def test_parallel_scan_reads_every_page_of_every_segment(self, mocker):
+        pages = {
+            (0, None): {'Items': [{'sk': 0}], 'LastEvaluatedKey': {'sk': 0}},
+            (0, 0): {'Items': [{'sk': 1}]},
+            (1, None): {'Items': [{'sk': 2}, {'sk': 3}]},
+            (2, None): {'Items': []},
+        }
+        session = mocker.patch('boto3.session.Session').return_value
+        scan = session.resource.return_value.Table.return_value.scan
+        scan.side_effect = lambda Segment, TotalSegments, Limit, ExclusiveStartKey=None: pages[
+            (Segment, ExclusiveStartKey and ExclusiveStartKey['sk'])
+        ]
+
+        results = list(dynamodb.parallel_scan(TABLE_NAME, total_segments=3, Limit=10))
+
+        assert sorted(item['sk'] for item in results) == [0, 1, 2, 3]
+        assert scan.call_count == 4
+
+    def test_parallel_scan_creates_one_table_per_worker(self, mocker):
+        session = mocker.patch('boto3.session.Session').return_value
+        scan = session.resource.return_value.Table.return_value.scan
+        scan.side_effect = lambda Segment, TotalSegments, ExclusiveStartKey=None: (
+            {'Items': [{'sk': Segment}], 'LastEvaluatedKey': {'sk': Segment}}
+            if ExclusiveStartKey is None
+            else {'Items': []}
+        )
+
+        results = list(dynamodb.parallel_scan(TABLE_NAME, total_segments=4, max_workers=2))
+
+        assert sorted(item['sk'] for item in results) == [0, 1, 2, 3]
+        assert scan.call_count == 8
+        assert session.resource.call_count <= 2
+
+
+class TestItemCache:
+    def test_get_item_reads_through_cache(self, mock_dynamodb_resource):
+        get_item = mock_dynamodb_resource.Table.return_value.get_item
+        get_item.return_value = {'Item': {'pk': 'a', 'sk': 1}}
+        cache = dynamodb.ItemCache()
+
+        for _ in range(3):
+            assert dynamodb.get_item(TABLE_NAME, {'pk': 'a', 'sk': 1}, cache=cache) == {
+                'pk': 'a',
+                'sk': 1,
+            }
+
+        assert get_item.call_count == 1
+
+    def test_missing_items_are_cached(self, mock_dynamodb_resource):
+        get_item = mock_dynamodb_resource.Table.return_value.get_item
+        get_item.return_value = {}
+        cache = dynamodb.ItemCache()
+
+        assert dynamodb.get_item(TABLE_NAME, {'pk': 'a', 'sk': 1}, cache=cache) is None
+        assert dynamodb.get_item(TABLE_NAME, {'pk': 'a', 'sk': 1}, cache=cache) is None
+
+        assert get_item.call_count == 1
+
+    def test_expired_items_are_refetched(self, mocker):
+        monotonic = mocker.patch('common.aws_utils.dynamodb.time.monotonic', return_value=100)
+        cache = dynamodb.ItemCache(ttl=10)
+        cache.set(TABLE_NAME, {'pk': 'a'}, {'pk': 'a'})
+
+        monotonic.return_value = 109
+        assert cache.get(TABLE_NAME, {'pk': 'a'}) == {'pk': 'a'}
+        monotonic.return_value = 110
+        assert cache.get(TABLE_NAME, {'pk': 'a'}) is None
+
+    def test_evicts_least_recently_used_items(self):
+        cache = dynamodb.ItemCache(ttl=60, max_size=2)
+        cache.set(TABLE_NAME, {'pk': 'a'}, {'pk': 'a'})
+        cache.set(TABLE_NAME, {'pk': 'b'}, {'pk': 'b'})
+        cache.get(TABLE_NAME, {'pk': 'a'})
+        cache.set(TABLE_NAME, {'pk': 'c'}, {'pk': 'c'})
+
+        assert len(cache) == 2
+        assert cache.get(TABLE_NAME, {'pk': 'b'}) is None
+        assert cache.get(TABLE_NAME, {'pk': 'a'}) == {'pk': 'a'}
+
+    def test_batch_get_only_fetches_uncached_keys(self, items):
+        dynamodb.batch_write_items(TABLE_NAME, put_items=items[:3])
+        cache = dynamodb.ItemCache()
+        keys = [{'pk': item['pk'], 'sk': item['sk']} for item in items[:3]]
+        dynamodb.batch_get_items(TABLE_NAME, keys[:2] + [{'pk': 'nope', 'sk': 0}], cache=cache)
+
+        assert len(cache) == 3
+
+        dynamodb.batch_write_items(TABLE_NAME, delete_keys=keys[:2])
+        retrieved = dynamodb.batch_get_items(
+            TABLE_NAME, keys + [{'pk': 'nope', 'sk': 0}], cache=cache
+        )
+
+        assert sorted(retrieved, key=lambda item: item['sk']) == items[:3]
+
+    def test_decimal_key_values_match_numbers(self):
+        cache = dynamodb.ItemCache()
+        cache.set(TABLE_NAME, {'pk': 'a', 'sk': decimal.Decimal(1)}, {'pk': 'a', 'sk': 1})
+
+        assert cache.get(TABLE_NAME, {'pk': 'a', 'sk': 1}) == {'pk': 'a', 'sk': 1}
+
+    def test_writes_invalidate_cached_items(self, items):
+        cache = dynamodb.ItemCache()
+        key = {'pk': 'p0', 'sk': 0}
+        assert dynamodb.get_item(TABLE_NAME, key, cache=cache) is None
+
+        dynamodb.batch_write_items(
+            TABLE_NAME, put_items=items[:1], cache=cache, key_attributes=['pk', 'sk']
+        )
+
+        assert dynamodb.get_item(TABLE_NAME, key, cache=cache) == items[0]
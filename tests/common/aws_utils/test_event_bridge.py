@@ -0,0 +1,196 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from common import exceptions
+from common.aws_utils import event_bridge
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(mocker):
+    return mocker.patch('common.aws_utils.event_bridge.time.sleep')
+
+
+@pytest.fixture(params=(False, True), ids=('foreground', 'background'))
+def publisher(request, mocker):
+    publisher = event_bridge.EventPublisher(background=request.param)
+    mocker.spy(publisher._client, 'put_events')
+    return publisher
+
+
+def _sent_batches(publisher):
+    return [call[1]['Entries'] for call in publisher._client.put_events.call_args_list]
+
+
+class TestEventPublisher:
+    def test_uses_event_bridge_source_environment_variable(self, publisher):
+        publisher.publish('Thing', {'id': 1})
+        publisher.flush()
+
+        (entry,) = _sent_batches(publisher)[0]
+        assert entry == {
+            'Source': 'com.example.test:test',
+            'DetailType': 'Thing',
+            'Detail': json.dumps({'id': 1}),
+        }
+
+    def test_flushes_every_ten_entries(self, publisher):
+        for i in range(25):
+            publisher.publish('Thing', {'id': i})
+
+        assert len(publisher) == 5
+
+        metrics = publisher.flush()
+
+        assert [len(batch) for batch in _sent_batches(publisher)] == [10, 10, 5]
+        assert [
+            json.loads(e['Detail'])['id'] for b in _sent_batches(publisher) for e in b
+        ] == list(range(25))
+        assert metrics.entries == 5
+        assert [m.entries for m in publisher.flush_metrics] == [10, 10, 5]
+
+    def test_sends_full_batch_without_waiting_for_flush(self, mocker):
+        publisher = event_bridge.EventPublisher()
+        mocker.spy(publisher._client, 'put_events')
+        for i in range(10):
+            publisher.publish('Thing', {'id': i})
+
+        assert len(publisher) == 0
+        assert [len(batch) for batch in _sent_batches(publisher)] == [10]
+
+    def test_keeps_bounded_flush_metrics(self, publisher):
+        for i in range((event_bridge.MAX_FLUSH_METRICS + 5) * 10):
+            publisher.publish('Thing', {'id': i})
+        publisher.flush()
+
+        assert len(publisher.flush_metrics) == event_bridge.MAX_FLUSH_METRICS
+
+    def test_flushes_before_exceeding_request_size_limit(self, publisher):
+        detail = 'x' * (100 * 1024)
+        for _ in range(3):
+            publisher.publish('Big', detail)
+        publisher.flush()
+
+        assert [len(batch) for batch in _sent_batches(publisher)] == [2, 1]
+        assert all(
+            sum(map(event_bridge.get_entry_size, batch)) <= event_bridge.MAX_REQUEST_SIZE_BYTES
+            for batch in _sent_batches(publisher)
+        )
+
+    def test_rejects_oversized_events(self, publisher):
+        with pytest.raises(ValueError):
+            publisher.publish('Huge', 'x' * event_bridge.MAX_REQUEST_SIZE_BYTES)
+
+    def test_flush_without_entries_is_a_no_op(self, publisher):
+        assert publisher.flush() is None
+        assert publisher._client.put_events.call_count == 0
+
+    def test_retries_only_failed_entries(self, publisher, mocker):
+        responses = iter(
+            (
+                {
+                    'FailedEntryCount': 1,
+                    'Entries': [{'EventId': '1'}, {'ErrorCode': 'Throttled'}, {'EventId': '3'}],
+                },
+                {'FailedEntryCount': 0, 'Entries': [{'EventId': '2'}]},
+            )
+        )
+        publisher._client.put_events = mocker.Mock(side_effect=lambda **_: next(responses))
+        for i in range(3):
+            publisher.publish('Thing', {'id': i})
+
+        metrics = publisher.flush()
+
+        batches = _sent_batches(publisher)
+        assert [json.loads(entry['Detail'])['id'] for entry in batches[1]] == [1]
+        assert metrics == metrics._replace(
+            entries=3, requests=2, retried_entries=1, failed_entries=0
+        )
+
+    def test_raises_error_when_entries_exhaust_retries(self, publisher, mocker):
+        publisher.max_retries = 2
+        publisher._client.put_events = mocker.Mock(
+            return_value={'FailedEntryCount': 1, 'Entries': [{'ErrorCode': 'InternalFailure'}]}
+        )
+        publisher.publish('Thing', {'id': 1})
+
+        with pytest.raises(exceptions.EventPublishError) as ctx:
+            publisher.flush()
+
+        assert len(ctx.value.failed_entries) == 1
+        assert publisher._client.put_events.call_count == 3
+        assert publisher.flush_metrics[-1].failed_entries == 1
+
+    def test_retries_entries_of_failed_requests(self, publisher, mocker):
+        throttled = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'PutEvents')
+        publisher._client.put_events = mocker.Mock()
+        publisher._client.put_events.side_effect = [
+            throttled,
+            {'FailedEntryCount': 0, 'Entries': [{}] * 10},
+            {'FailedEntryCount': 0, 'Entries': [{}] * 5},
+        ]
+        for i in range(15):
+            publisher.publish('Thing', {'id': i})
+
+        publisher.flush()
+
+        assert [len(batch) for batch in _sent_batches(publisher)] == [10, 10, 5]
+        assert [m.retried_entries for m in publisher.flush_metrics] == [10, 0]
+
+    def test_reports_every_entry_when_background_requests_fail(self, mocker):
+        publisher = event_bridge.EventPublisher(background=True, max_retries=1)
+        publisher._client.put_events = mocker.Mock(
+            side_effect=ClientError({'Error': {'Code': 'ThrottlingException'}}, 'PutEvents')
+        )
+        for i in range(15):
+            publisher.publish('Thing', {'id': i})
+
+        with pytest.raises(exceptions.EventPublishError) as ctx:
+            publisher.flush()
+
+        assert len(ctx.value.failed_entries) == 15
+        assert publisher._client.put_events.call_count == 4
+        assert len(publisher) == 0
+
+
+class TestPublishesEvents:
+    @pytest.fixture
+    def failing_publisher(self, mocker):
+        publisher = event_bridge.EventPublisher()
+        mocker.patch.object(
+            publisher, 'flush', side_effect=exceptions.EventPublishError('Oh no!', [{}])
+        )
+        return publisher
+
+    def test_flush_failure_does_not_replace_handler_error(self, failing_publisher):
+        @event_bridge.publishes_events(failing_publisher)
+        def handler(event, context):
+            raise ValueError('Handler failed')
+
+        with pytest.raises(ValueError):
+            handler({}, None)
+
+        assert failing_publisher.flush.call_count == 1
+
+    def test_flush_failure_is_raised_after_successful_handler(self, failing_publisher):
+        handler = event_bridge.publishes_events(failing_publisher)(lambda event, context: 'ok')
+
+        with pytest.raises(exceptions.EventPublishError):
+            handler({}, None)
+
+
+def test_publishes_events_flushes_after_handler_errors(mocker):
+    publisher = event_bridge.EventPublisher()
+    mocker.spy(publisher, 'flush')
+
+    @event_bridge.publishes_events(publisher)
+    def handler(event, context):
+        publisher.publish('Thing', event)
+        raise ValueError('Oh no!')
+
+    with pytest.raises(ValueError):
+        handler({'id': 1}, None)
+
+    assert publisher.flush.call_count == 1
+    assert len(publisher) == 0
@@ -0,0 +1,185 @@
+import json
+
+import boto3
+import pytest
+
+from common import exceptions
+from common.aws_utils import api_gateway, idempotency
+
+
+TABLE_NAME = 'idempotency-records'
+
+
+@pytest.fixture(autouse=True)
+def table(monkeypatch):
+    monkeypatch.setenv('IDEMPOTENCY_TABLE_NAME', TABLE_NAME)
+    return boto3.resource('dynamodb').create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def handler(calls):
+    @api_gateway.format_errors
+    @idempotency.idempotent()
+    @api_gateway.requires_json_payload
+    def create_thing(event, context):
+        calls.append(event['body'])
+        if event['body'].get('fail'):
+            raise exceptions.HTTPBadRequestError('Nope')
+        return api_gateway.HTTPResponse(status_code=201, body={'id': len(calls)})
+
+    return create_thing
+
+
+def _event(body, headers=None, principal_id='user-1', path='/v1/things', query=None):
+    return {
+        'httpMethod': 'POST',
+        'resource': '/v1/things',
+        'path': path,
+        'queryStringParameters': query,
+        'headers': headers,
+        'requestContext': {'authorizer': {'principalId': principal_id}},
+        'body': body,
+    }
+
+
+class TestGetIdempotencyKey:
+    def test_equivalent_payloads_produce_the_same_key(self):
+        assert idempotency.get_idempotency_key(
+            _event('{"a": 1, "b": [1, 2]}')
+        ) == idempotency.get_idempotency_key(_event({'b': [1, 2], 'a': 1}))
+
+    def test_header_takes_precedence_over_payload(self):
+        assert idempotency.get_idempotency_key(
+            _event('{"a": 1}', headers={'idempotency-key': 'abc'})
+        ) == idempotency.get_idempotency_key(
+            _event('{"a": 2}', headers={'Idempotency-Key': 'abc'})
+        )
+
+    @pytest.mark.parametrize(
+        'other_event',
+        (
+            _event('{"a": 2}'),
+            _event('{"a": 1}', principal_id='user-2'),
+            _event('{"a": 1}', query={'dry_run': 'true'}),
+        ),
+        ids=('different payload', 'different principal', 'different querystring'),
+    )
+    def test_distinct_requests_produce_distinct_keys(self, other_event):
+        assert idempotency.get_idempotency_key(
+            _event('{"a": 1}')
+        ) != idempotency.get_idempotency_key(other_event)
+
+
+class TestIdempotent:
+    def test_replays_completed_response_from_memory(self, handler, calls, mocker):
+        first = handler(_event('{"name": "thing"}'), None)
+        resource = mocker.patch('boto3.resource')
+        second = handler(_event('{"name": "thing"}'), None)
+
+        assert len(calls) == 1
+        assert resource.call_count == 0
+        assert second['body'] == first['body']
+        assert second['statusCode'] == '201'
+        assert second['headers'][idempotency.REPLAYED_HEADER] == 'true'
+
+    def test_replays_completed_response_from_dynamodb(self, handler, calls, table):
+        handler(_event('{"name": "thing"}'), None)
+
+        @idempotency.idempotent()
+        @api_gateway.requires_json_payload
+        def other_container(event, context):
+            calls.append(event['body'])
+
+        response = other_container(_event('{"name": "thing"}'), None)
+
+        assert len(calls) == 1
+        assert json.loads(response['body']) == {'id': 1}
+
+    def test_rejects_concurrent_duplicate_requests(self, handler, calls, table):
+        key = idempotency.get_idempotency_key(_event('{"name": "thing"}'))
+        table.put_item(
+            Item={'id': key, 'status': idempotency.STATUS_IN_PROGRESS, 'expiration': 2 ** 40}
+        )
+
+        response = handler(_event('{"name": "thing"}'), None)
+
+        assert response['statusCode'] == '409'
+        assert calls == []
+
+    def test_takes_over_expired_in_progress_records(self, handler, calls, table):
+        key = idempotency.get_idempotency_key(_event('{"name": "thing"}'))
+        table.put_item(Item={'id': key, 'status': idempotency.STATUS_IN_PROGRESS, 'expiration': 1})
+
+        assert handler(_event('{"name": "thing"}'), None)['statusCode'] == '201'
+        assert len(calls) == 1
+
+    def test_distinct_path_parameters_are_not_replayed(self, handler, calls):
+        def user_event(user_id):
+            return dict(
+                _event('{"active": false}', path=f'/v1/users/{user_id}'),
+                resource='/v1/users/{user_id}',
+                pathParameters={'user_id': user_id},
+            )
+
+        first = handler(user_event('1'), None)
+        second = handler(user_event('2'), None)
+
+        assert len(calls) == 2
+        assert idempotency.REPLAYED_HEADER not in second['headers']
+        assert json.loads(second['body']) != json.loads(first['body'])
+
+    def test_failed_requests_are_not_stored(self, handler, calls, table):
+        assert handler(_event('{"fail": true}'), None)['statusCode'] == '400'
+        assert handler(_event('{"fail": true}'), None)['statusCode'] == '400'
+
+        assert len(calls) == 2
+        assert table.scan()['Items'] == []
+
+    def test_rejects_reused_key_with_different_payload(self, handler, calls, table):
+        headers = {idempotency.IDEMPOTENCY_KEY_HEADER: 'abc'}
+        handler(_event('{"name": "thing"}', headers=headers), None)
+
+        @api_gateway.format_errors
+        @idempotency.idempotent()
+        @api_gateway.requires_json_payload
+        def other_container(event, context):
+            calls.append(event['body'])
+
+        for fn in (handler, other_container):
+            assert fn(_event('{"name": "other"}', headers=headers), None)['statusCode'] == '422'
+        assert len(calls) == 1
+
+    def test_delete_failure_does_not_replace_handler_error(self, mocker):
+        table = mocker.patch('boto3.resource').return_value.Table.return_value
+        table.delete_item.side_effect = RuntimeError('DynamoDB is down')
+
+        @idempotency.idempotent()
+        def handler(event, context):
+            raise ValueError('Handler failed')
+
+        with pytest.raises(ValueError):
+            handler(_event('{"name": "thing"}'), None)
+
+        assert table.delete_item.call_count == 1
+
+
+def test_response_cache_evicts_least_recently_used_entries():
+    cache = idempotency.ResponseCache(max_size=2)
+    cache.set('a', {'body': 'a'}, 2 ** 40)
+    cache.set('b', {'body': 'b'}, 2 ** 40)
+    cache.get('a')
+    cache.set('c', {'body': 'c'}, 2 ** 40)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == {'body': 'a'}
+    assert len(cache) == 2
@@ -0,0 +1,137 @@
+import json
+
+import boto3
+import pytest
+
+from common.aws_utils import api_gateway, rate_limiting
+
+
+TABLE_NAME = 'rate-limits'
+
+
+@pytest.fixture(autouse=True)
+def table(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_TABLE_NAME', TABLE_NAME)
+    return boto3.resource('dynamodb').create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+
+@pytest.fixture
+def now(mocker):
+    return mocker.patch('common.aws_utils.rate_limiting.time.time', return_value=6000.0)
+
+
+@pytest.fixture
+def handler(now):
+    @api_gateway.format_errors
+    @rate_limiting.rate_limited(limit=5, period=60, lease_size=2, scope='test')
+    def expensive(event, context):
+        return api_gateway.HTTPResponse(body='ok')
+
+    return expensive
+
+
+def _event(principal_id='user-1'):
+    return {'requestContext': {'authorizer': {'principalId': principal_id}}}
+
+
+def _status_codes(handler, count, principal_id='user-1'):
+    return [handler(_event(principal_id), None)['statusCode'] for _ in range(count)]
+
+
+class TestRateLimited:
+    def test_throttles_principal_after_limit(self, handler):
+        assert _status_codes(handler, 7) == ['200'] * 5 + ['429'] * 2
+
+    def test_throttled_response_has_retry_after_header(self, handler, now):
+        response = [handler(_event(), None) for _ in range(6)][-1]
+
+        assert response['statusCode'] == '429'
+        assert response['headers']['Retry-After'] == '12'
+        assert json.loads(response['body'])['description'] == 'Too Many Requests'
+
+        now.return_value = 6005.5
+        assert handler(_event(), None)['headers']['Retry-After'] == '7'
+
+    def test_principals_are_limited_independently(self, handler):
+        assert _status_codes(handler, 6, 'user-1')[-1] == '429'
+        assert _status_codes(handler, 5, 'user-2') == ['200'] * 5
+
+    def test_bucket_is_refilled_continuously(self, handler, now):
+        _status_codes(handler, 6)
+
+        now.return_value = 6012.0
+        assert _status_codes(handler, 2) == ['200', '429']
+
+        now.return_value = 6100.0
+        assert _status_codes(handler, 6) == ['200'] * 5 + ['429']
+
+    def test_does_not_allow_bursts_across_minute_boundaries(self, handler, now):
+        now.return_value = 6059.0
+        assert _status_codes(handler, 5) == ['200'] * 5
+
+        now.return_value = 6061.0
+        assert _status_codes(handler, 1) == ['429']
+
+    def test_only_calls_dynamodb_when_local_tokens_run_out(self, handler, mocker):
+        lease_tokens = mocker.spy(rate_limiting.TokenBucketRateLimiter, '_lease_tokens')
+
+        _status_codes(handler, 4)
+
+        assert lease_tokens.call_count == 2
+
+    def test_unspent_leases_expire(self, handler, now, mocker):
+        lease_tokens = mocker.spy(rate_limiting.TokenBucketRateLimiter, '_lease_tokens')
+        _status_codes(handler, 1)
+
+        now.return_value = 6030.0
+        _status_codes(handler, 1)
+
+        assert lease_tokens.call_count == 2
+
+    def test_throttles_from_memory_until_a_token_is_refilled(self, handler, now, mocker):
+        lease_tokens = mocker.spy(rate_limiting.TokenBucketRateLimiter, '_lease_tokens')
+        assert _status_codes(handler, 6)[-1] == '429'
+        throttled_lease_count = lease_tokens.call_count
+
+        now.return_value = 6011.0
+        assert _status_codes(handler, 10) == ['429'] * 10
+        assert lease_tokens.call_count == throttled_lease_count
+
+        now.return_value = 6012.0
+        assert _status_codes(handler, 1) == ['200']
+        assert lease_tokens.call_count == throttled_lease_count + 1
+
+    def test_limit_is_shared_across_containers(self, handler):
+        @api_gateway.format_errors
+        @rate_limiting.rate_limited(limit=5, period=60, lease_size=2, scope='test')
+        def other_container(event, context):
+            return api_gateway.HTTPResponse(body='ok')
+
+        assert _status_codes(handler, 1) == ['200']
+        assert _status_codes(other_container, 4) == ['200'] * 3 + ['429']
+        assert _status_codes(handler, 2) == ['200', '429']
+
+    def test_retries_lease_when_bucket_changes_concurrently(self, table, mocker):
+        limiter = rate_limiting.TokenBucketRateLimiter(limit=5, lease_size=2, scope='test')
+        other_container = rate_limiting.TokenBucketRateLimiter(limit=5, lease_size=2, scope='test')
+        mocker.patch('boto3.resource').return_value.Table.return_value = table
+        read_item = table.get_item
+
+        def read_then_lease_from_other_container(**kwargs):
+            item = read_item(**kwargs)
+            if get_item.call_count == 1:
+                other_container.acquire('user-1')
+            return item
+
+        get_item = mocker.patch.object(
+            table, 'get_item', side_effect=read_then_lease_from_other_container
+        )
+
+        assert limiter._lease_tokens('user-1', 6000.0) == (2, 1.0)
+        # The first read is stale, the second is the other container's, the third succeeds
+        assert get_item.call_count == 3
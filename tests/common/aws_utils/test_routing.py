@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from common import exceptions
+from common.aws_utils import api_gateway, routing
+
+
+@pytest.fixture
+def router():
+    router = routing.Router()
+
+    def respond_with(name):
+        return lambda event, context: api_gateway.HTTPResponse(
+            body={'route': name, 'pathParameters': event.get('pathParameters')}
+        )
+
+    router.add_route('GET', '/v1/things', respond_with('list'))
+    router.add_route('POST', '/v1/things', respond_with('create'))
+    router.add_route('GET', '/v1/things/{thing_id}', respond_with('get'))
+    router.add_route('GET', '/v1/things/latest', respond_with('latest'))
+    router.add_route('GET', '/v1/things/{thing_id}/parts', respond_with('parts'))
+    router.add_route('ANY', '/v1/files/{path+}', respond_with('files'))
+
+    @router.route('DELETE', '/v1/things/{thing_id}')
+    def delete_thing(event, context):
+        raise exceptions.HTTPNotFoundError(f'No thing {event["pathParameters"]["thing_id"]}')
+
+    return router
+
+
+def _handle(router, method, path, resource='/{proxy+}'):
+    response = router.handle({'httpMethod': method, 'path': path, 'resource': resource}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+class TestRouter:
+    @pytest.mark.parametrize(
+        'method, path, expected_route, expected_path_parameters',
+        (
+            ('GET', '/v1/things', 'list', None),
+            ('post', '/v1/things/', 'create', None),
+            ('GET', '/v1/things/abc', 'get', {'thing_id': 'abc'}),
+            ('GET', '/v1/things/latest', 'latest', None),
+            ('GET', '/v1/things/latest/parts', 'parts', {'thing_id': 'latest'}),
+            ('PUT', '/v1/files/a/b/c.json', 'files', {'path': 'a/b/c.json'}),
+        ),
+        ids=(
+            'static route',
+            'method and trailing slash are normalized',
+            'path parameter',
+            'static segment preferred over path parameter',
+            'path parameter matched when static segment has no route',
+            'greedy path parameter with ANY method',
+        ),
+    )
+    def test_dispatches_by_method_and_path(
+        self, router, method, path, expected_route, expected_path_parameters
+    ):
+        status_code, body = _handle(router, method, path)
+
+        assert status_code == '200'
+        assert body['route'] == expected_route
+        assert body['pathParameters'] == expected_path_parameters
+
+    def test_sets_resource_to_matched_route(self):
+        router = routing.Router()
+        router.add_route(
+            'GET',
+            '/v1/things/{thing_id}/parts',
+            lambda event, context: api_gateway.HTTPResponse(body={'resource': event['resource']}),
+        )
+
+        status_code, body = _handle(router, 'GET', '/v1/things/abc/parts')
+
+        assert status_code == '200'
+        assert body['resource'] == '/v1/things/{thing_id}/parts'
+
+    def test_dispatches_by_resolved_resource(self, router):
+        status_code, body = _handle(
+            router, 'GET', '/v1/things/abc', resource='/v1/things/{thing_id}'
+        )
+
+        assert status_code == '200'
+        assert body['route'] == 'get'
+
+    def test_formats_handler_errors(self, router):
+        assert _handle(router, 'DELETE', '/v1/things/abc') == (
+            '404',
+            {'description': 'Resource not found', 'error': 'No thing abc'},
+        )
+
+    @pytest.mark.parametrize('path', ('/v1/nothing', '/v1/things/abc/def', '/v1/files'))
+    def test_responds_not_found_for_unknown_paths(self, router, path):
+        assert _handle(router, 'GET', path)[0] == '404'
+
+    def test_responds_method_not_allowed_for_unknown_methods(self, router):
+        response = router.handle(
+            {'httpMethod': 'PATCH', 'path': '/v1/things/abc', 'resource': '/{proxy+}'}, None
+        )
+
+        assert response['statusCode'] == '405'
+        assert response['headers']['Allow'] == 'DELETE, GET'
+
+    @pytest.mark.parametrize(
+        'method, resource',
+        (('GET', '/v1/things'), ('GET', '/v1/things/{other_id}/parts')),
+        ids=('duplicate route', 'conflicting path parameter names'),
+    )
+    def test_rejects_conflicting_routes(self, router, method, resource):
+        with pytest.raises(ValueError):
+            router.add_route(method, resource, lambda event, context: None)
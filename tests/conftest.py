@@ -15,8 +15,12 @@ os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
 os.environ['AWS_SECURITY_TOKEN'] = 'testing'
 os.environ['AWS_SESSION_TOKEN'] = 'testing'
 os.environ['AWS_DEFAULT_REGION'] = 'us-west-2'
+# Newer botocore versions send S3 uploads with aws-chunked checksums by default,
+# which older versions of moto cannot decode; only send checksums when S3 requires them
+os.environ['AWS_REQUEST_CHECKSUM_CALCULATION'] = 'when_required'
 os.environ['THOR_API_SECRET_KEY__SSM_KEY'] = '/secret/key/param/name'
 os.environ['SENTRY_DSN'] = ''
+os.environ['EVENT_BRIDGE_SOURCE'] = 'com.example.test:test'
 
 
 @pytest.fixture(scope='session')
@@ -32,6 +36,8 @@ def mock_aws_environment(secret_key):
         mock_aws_service_context_managers = (
             moto.mock_ssm(),
             moto.mock_dynamodb2(),
+            moto.mock_events(),
+            moto.mock_s3(),
         )
         # fmt: on
         for service_mock in mock_aws_service_context_managers:
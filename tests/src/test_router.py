@@ -0,0 +1,17 @@
+import json
+
+from src import router
+
+
+def test_route__http_dispatches_to_greeting_handler():
+    event = {
+        'httpMethod': 'GET',
+        'resource': '/{proxy+}',
+        'path': '/v1/greeting',
+        'queryStringParameters': {'person': 'Joe'},
+    }
+
+    api_response = router.route__http(event=event, context=None)
+
+    assert 200 == int(api_response['statusCode'])
+    assert {'phrase': 'Hello, Joe!', 'is_personalized': True} == json.loads(api_response['body'])